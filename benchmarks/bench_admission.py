@@ -0,0 +1,144 @@
+"""
+Control loop dispatch latency during a challenge storm.
+
+A local mock Lichess server answers every accept and decline after 500 ms. The benchmark feeds a storm of supported and
+unsupported challenges plus game starts through `handle_event` and reports how long each event blocks the control loop,
+once with the admission workers and once with synchronous accepts/declines (the previous behaviour).
+
+usage: python benchmarks/bench_admission.py [--challenges 200] [--latency 0.5]
+"""
+
+import argparse
+import importlib
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from src import lichess  # noqa: E402
+from src.account import Account  # noqa: E402
+from src.admission import AdmissionWorkers  # noqa: E402
+
+bot = importlib.import_module("lichess-bot")
+
+CONFIG = {
+    "url": "http://127.0.0.1/",
+    "engine": {},
+    "challenge": {
+        "concurrency": 4,
+        "variants": ["standard"],
+        "time_controls": ["bullet", "blitz"],
+        "modes": ["casual", "rated"],
+    },
+}
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def mock_handler(latency):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            time.sleep(latency)
+            body = json.dumps({"ok": True}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+class SynchronousAdmission(AdmissionWorkers):
+    """Accepts and declines inline, like the control loop did before the admission workers."""
+
+    def __init__(self, control_queue):
+        super().__init__(control_queue, workers=0)
+
+    def accept(self, account, challenge, kind="game"):
+        self._accept(account, challenge, kind)
+        return True
+
+    def decline(self, account, challenge):
+        self._decline(account, challenge)
+
+
+class DummyPool:
+    def apply_async(self, *args, **kwargs):
+        pass
+
+
+def challenge_event(index):
+    return {"type": "challenge", "account": "bot", "challenge": {
+        "id": "c{}".format(index),
+        "rated": True,
+        "variant": {"key": "standard" if index % 2 else "atomic"},
+        "perf": {"name": "Blitz"},
+        "speed": "blitz",
+        "timeControl": {"increment": 0},
+        "challenger": {"name": "player{}".format(index), "rating": 1500 + index},
+    }}
+
+
+def run(admission_class, url, challenges):
+    control_queue = queue.Queue()
+    li = lichess.Lichess("token", url, "bench")
+    account = Account(li, {"username": "bot"}, None, dict(CONFIG, url=url))
+    admission = admission_class(control_queue)
+
+    events = []
+    for index in range(challenges):
+        events.append(challenge_event(index))
+        if index % 10 == 9:
+            events.append({"type": "gameStart", "account": "bot", "game": {"id": "c{}".format(index)}})
+            events.append({"type": "local_game_done", "account": "bot", "game_id": "c{}".format(index),
+                           "engine_stats": {"route": "default", "searches": 0, "search_time": 0, "nodes": 0},
+                           "game_stats": {"speed": "blitz", "variant": "standard", "nominal": 600, "duration": 400,
+                                          "score": 0.5, "pid": 0, "rss": 0, "rss_growth": 0}})
+
+    latencies = []
+    for event in events:
+        start = time.perf_counter()
+        bot.handle_event(event, account, [account], DummyPool(), control_queue, admission)
+        latencies.append(time.perf_counter() - start)
+        while not control_queue.empty():
+            bot.handle_event(control_queue.get_nowait(), account, [account], DummyPool(), control_queue, admission)
+    admission.close()
+
+    latencies.sort()
+    return {
+        "events": len(latencies),
+        "p50 ms": round(1000 * latencies[len(latencies) // 2], 2),
+        "p99 ms": round(1000 * latencies[int(len(latencies) * 0.99)], 2),
+        "max ms": round(1000 * latencies[-1], 2),
+        "total s": round(sum(latencies), 2),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure control loop dispatch latency under a challenge storm")
+    parser.add_argument("--challenges", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.5, help="Mock server latency in seconds.")
+    args = parser.parse_args()
+
+    import logging
+    logging.disable(logging.INFO)
+
+    server = ThreadingServer(("127.0.0.1", 0), mock_handler(args.latency))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    URL = "http://127.0.0.1:{}/".format(server.server_address[1])
+
+    print("admission workers: {}".format(run(AdmissionWorkers, URL, args.challenges)))
+    print("synchronous:       {}".format(run(SynchronousAdmission, URL, min(args.challenges, 20))))
+    server.shutdown()
@@ -0,0 +1,120 @@
+"""
+Micro-benchmarks of the helpers that run on every move or event.
+
+Every case is timed with timeit and reported in microseconds per call. `--save` stores the results as the baselines
+(benchmarks/baselines.json) and `--check` fails if any case got slower than its baseline by more than `--tolerance`.
+Baselines only compare on the same machine, so save them before a change and check after it.
+
+usage: python benchmarks/bench_helpers.py [--save | --check] [--tolerance 1.5]
+"""
+
+import argparse
+import importlib
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import chess  # noqa: E402
+
+from src import model  # noqa: E402
+from src.engine_wrapper import EngineWrapper, is_endgame, DRAW_CONDITIONS, RESIGNATION_CONDITIONS  # noqa: E402
+
+bot = importlib.import_module("lichess-bot")
+
+BASELINES = os.path.join(os.path.dirname(__file__), "baselines.json")
+
+MOVES = ("e2e4 e7e5 g1f3 b8c6 f1b5 a7a6 b5a4 g8f6 e1g1 f8e7 f1e1 b7b5 a4b3 d7d6 c2c3 e8g8 h2h3 c6a5 b3c2 c7c5 "
+         "d2d4 d8c7 b1d2 c5d4 c3d4 a5c6 d2b3 a6a5 c1e3 a5a4 b3d2 c8d7 a1c1 c7b7 d2f1 f8c8 f1g3 c6b4 c2b1 d7e6 "
+         "a2a3 b4c6 d4d5 c6a5 e3g5 a5c4 b2b3 a4b3 b1d3 f6d7 g5e7 b3b2 c1c2 b2b1q").split()
+
+CHALLENGE = {
+    "id": "abcdefgh", "rated": True, "variant": {"key": "standard"}, "perf": {"name": "Blitz"}, "speed": "blitz",
+    "timeControl": {"limit": 180, "increment": 2}, "challenger": {"name": "someone", "rating": 1800, "title": "FM"},
+}
+CHALLENGE_CONFIG = {"variants": ["standard", "chess960"], "time_controls": ["bullet", "blitz", "rapid"],
+                    "modes": ["casual", "rated"], "accept_bot": True}
+GAME_FULL = {
+    "type": "gameFull", "id": "abcdefgh", "speed": "blitz", "rated": True, "initialFen": "startpos",
+    "variant": {"key": "standard", "name": "Standard"}, "clock": {"initial": 180000, "increment": 2000},
+    "perf": {"name": "Blitz"}, "white": {"name": "bot", "id": "bot", "rating": 2000},
+    "black": {"name": "someone", "id": "someone", "rating": 1800},
+    "state": {"type": "gameState", "moves": " ".join(MOVES), "wtime": 120000, "btime": 110000, "winc": 2000,
+              "binc": 2000, "status": "started"},
+}
+GAME_STATE_LINE = json.dumps(GAME_FULL["state"]).encode("utf-8")
+
+
+class Engine(EngineWrapper):
+    def __init__(self):
+        super().__init__(chess.Board(), [], {}, {"draw": dict(DRAW_CONDITIONS, sustain_turns=5, threshold=10),
+                                                 "resignation": dict(RESIGNATION_CONDITIONS, threshold=500)})
+        self.past_scores.extend(range(-20, 20))
+
+
+def cases():
+    board = chess.Board()
+    for move in MOVES[:30]:
+        board.push_uci(move)
+    engine = Engine()
+    challenge = model.Challenge(CHALLENGE)
+    game = model.Game(GAME_FULL, "bot", "https://lichess.org/", 20)
+
+    def update_board():
+        bot.update_board(board, "g1f3")
+        board.pop()
+
+    return {
+        "is_endgame": lambda: is_endgame(board),
+        "process_endgame_conditions": lambda: engine.process_endgame_conditions(board),
+        "get_pretty_stat nps": lambda: EngineWrapper.get_pretty_stat("nps", 1234567),
+        "get_pretty_stat nodes": lambda: EngineWrapper.get_pretty_stat("nodes", 98765432),
+        "challenge is_supported": lambda: challenge.is_supported(CHALLENGE_CONFIG),
+        "challenge score": challenge.score,
+        "update_board": update_board,
+        "setup_board": lambda: bot.setup_board(game),
+        "parse game state": lambda: json.loads(GAME_STATE_LINE.decode("utf-8")),
+    }
+
+
+def measure(repeat=7):
+    results = {}
+    for name, case in cases().items():
+        timer = timeit.Timer(case)
+        number, _ = timer.autorange()
+        results[name] = round(1e6 * min(timer.repeat(repeat, number)) / number, 3)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the per-move helpers against stored baselines")
+    parser.add_argument("--save", action="store_true", help="Store the results as the new baselines.")
+    parser.add_argument("--check", action="store_true", help="Exit with an error if a case regressed.")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="Allowed slowdown factor for --check.")
+    args = parser.parse_args()
+
+    RESULTS = measure()
+    BASELINE = {}
+    if os.path.exists(BASELINES):
+        with open(BASELINES) as baselines_file:
+            BASELINE = json.load(baselines_file)
+
+    REGRESSIONS = []
+    for NAME, MICROSECONDS in RESULTS.items():
+        line = "{:<28} {:>10.3f} us".format(NAME, MICROSECONDS)
+        if NAME in BASELINE:
+            ratio = MICROSECONDS / BASELINE[NAME]
+            line += "  {:>6.2f}x baseline".format(ratio)
+            if ratio > args.tolerance:
+                REGRESSIONS.append(NAME)
+        print(line)
+
+    if args.save:
+        with open(BASELINES, "w") as baselines_file:
+            json.dump(RESULTS, baselines_file, indent=2, sort_keys=True)
+            baselines_file.write("\n")
+    if args.check and REGRESSIONS:
+        print("Regressed: {}".format(", ".join(REGRESSIONS)))
+        sys.exit(1)
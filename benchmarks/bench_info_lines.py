@@ -0,0 +1,80 @@
+"""
+Bot-side CPU time per search at different engine verbosities.
+
+A fake UCI engine answers every search with a burst of info lines (score lines with a pv and currmove progress lines)
+and then a best move. The benchmark runs searches with every info line parsed (`info_lines: all`, the previous
+behaviour) and with only the latest lines parsed (`info_lines: latest`) and reports the CPU time of the bot process,
+which includes the engine reader thread.
+
+usage: python benchmarks/bench_info_lines.py [--searches 20] [--lines 100 1000 10000]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import chess  # noqa: E402
+
+from src.engine_wrapper import UCIEngine, DRAW_CONDITIONS, RESIGNATION_CONDITIONS  # noqa: E402
+
+FAKE_ENGINE = r'''
+import sys
+
+lines = int(sys.argv[1])
+pv = "e2e4 e7e5 g1f3 b8c6 f1b5 a7a6 b5a4 g8f6 e1g1 f8e7"
+for line in sys.stdin:
+    command = line.split()
+    if not command:
+        continue
+    if command[0] == "uci":
+        print("id name verbose\nuciok", flush=True)
+    elif command[0] == "isready":
+        print("readyok", flush=True)
+    elif command[0] == "go":
+        out = []
+        for i in range(lines):
+            if i % 4:
+                out.append("info depth {} currmove e2e4 currmovenumber {}".format(i // 4 + 1, i % 4))
+            else:
+                out.append("info depth {} seldepth {} multipv 1 score cp {} nodes {} nps 1000000 tbhits 0 "
+                           "time {} pv {}".format(i // 4 + 1, i // 4 + 5, 20 + i % 7, 1000 * i, i, pv))
+        out.append("bestmove e2e4 ponder e7e5")
+        print("\n".join(out), flush=True)
+    elif command[0] == "quit":
+        break
+'''
+
+
+def run(script, lines, info_lines, searches):
+    conditions = {"draw": DRAW_CONDITIONS, "resignation": RESIGNATION_CONDITIONS}
+    engine = UCIEngine(chess.Board(), [sys.executable, script, str(lines)], {}, conditions, info_lines=info_lines)
+    cpu = 0
+    for _ in range(searches):
+        start = time.process_time()
+        engine.search(chess.Board(), 60000, 60000, 0, 0)
+        cpu += time.process_time() - start
+    stats = engine.get_info_line_stats()
+    engine.quit()
+    return {"cpu ms per search": round(1000 * cpu / searches, 2),
+            "parsed per search": stats["parsed_lines"] // searches}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure bot-side CPU per search at different engine verbosities")
+    parser.add_argument("--searches", type=int, default=20)
+    parser.add_argument("--lines", type=int, nargs="+", default=[100, 1000, 10000], help="Info lines per search.")
+    args = parser.parse_args()
+
+    with tempfile.NamedTemporaryFile("w", suffix=".py", delete=False) as script_file:
+        script_file.write(FAKE_ENGINE)
+    try:
+        for LINES in args.lines:
+            for INFO_LINES in ("all", "latest"):
+                print("{:>6} lines, {:<6}: {}".format(LINES, INFO_LINES,
+                                                      run(script_file.name, LINES, INFO_LINES, args.searches)))
+    finally:
+        os.remove(script_file.name)
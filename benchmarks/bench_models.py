@@ -0,0 +1,89 @@
+"""
+Memory, pickle size and shared queue cost of the challenge model during a challenge storm.
+
+`--challenges` challenges are built with the slotted `model.Challenge` and with the dict-backed class it replaced,
+and the benchmark reports the memory they retain, their pickled size and the time to fill a Manager list the way the
+control loop does (one read and one write of the ranked queue per challenge).
+
+usage: python benchmarks/bench_models.py [--challenges 200 1000]
+"""
+
+import argparse
+import multiprocessing
+import os
+import pickle
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from src import model  # noqa: E402
+
+
+class DictChallenge:
+    """The previous challenge model: every field parsed eagerly into the instance dict, with the challenger's json."""
+
+    def __init__(self, c_info):
+        self.id = c_info["id"]
+        self.rated = c_info["rated"]
+        self.variant = c_info["variant"]["key"]
+        self.perf_name = c_info["perf"]["name"]
+        self.speed = c_info["speed"]
+        self.increment = c_info.get("timeControl", {}).get("increment", -1)
+        self.limit = c_info.get("timeControl", {}).get("limit", -1)
+        self.challenger = c_info.get("challenger")
+        self.challenger_title = self.challenger.get("title") if self.challenger else None
+        self.challenger_is_bot = self.challenger_title == "BOT"
+        self.challenger_master_title = self.challenger_title if not self.challenger_is_bot else None
+        self.challenger_name = self.challenger["name"] if self.challenger else "Anonymous"
+        self.challenger_rating_int = self.challenger["rating"] if self.challenger else 0
+        self.challenger_rating = self.challenger_rating_int or "?"
+
+    def score(self):
+        return self.challenger_rating_int + (200 if self.rated else 0) + (200 if self.challenger_master_title else 0)
+
+
+def challenge_json(index):
+    return {
+        "id": "c{:07d}".format(index), "url": "https://lichess.org/c{:07d}".format(index), "status": "created",
+        "rated": index % 2 == 0, "variant": {"key": "standard", "name": "Standard", "short": "Std"},
+        "perf": {"icon": ")", "name": "Blitz"}, "speed": "blitz", "color": "random",
+        "timeControl": {"type": "clock", "limit": 180, "increment": 2, "show": "3+2"},
+        "challenger": {"id": "player{}".format(index), "name": "Player{}".format(index), "title": None,
+                       "rating": 1500 + index % 700, "provisional": False, "online": True, "lag": 4},
+        "destUser": {"id": "bot", "name": "Bot", "title": "BOT", "rating": 2000, "online": True},
+    }
+
+
+def measure(cls, count):
+    # the json of every event is dropped once the challenge is built, only what the challenge keeps of it counts.
+    tracemalloc.start()
+    challenges = [cls(challenge_json(index)) for index in range(count)]
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    pickled = pickle.dumps(challenges)
+    pickle.loads(pickled)
+    pickle_time = time.perf_counter() - start
+
+    with multiprocessing.Manager() as manager:
+        queue = manager.list()
+        start = time.perf_counter()
+        for challenge in challenges:
+            queue[:] = sorted(queue[:] + [challenge], key=lambda c: -c.score())
+        queue_time = time.perf_counter() - start
+
+    return {"bytes each": retained // count, "pickled bytes each": len(pickled) // count,
+            "pickle round trip ms": round(1000 * pickle_time, 2), "shared queue s": round(queue_time, 2)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the memory and pickle cost of queued challenges")
+    parser.add_argument("--challenges", type=int, nargs="+", default=[200, 1000])
+    args = parser.parse_args()
+
+    for COUNT in args.challenges:
+        for NAME, CLS in (("dict", DictChallenge), ("slots", model.Challenge)):
+            print("{:>6} challenges, {:<5}: {}".format(COUNT, NAME, measure(CLS, COUNT)))
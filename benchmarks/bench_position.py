@@ -0,0 +1,109 @@
+"""
+Protocol overhead per move of sending the position to the engine, late in long games.
+
+A game is played out to `--plies` with a fixed seed, and at every ply count the bot sends the position of a search
+and of the ponder search after it (two plies later), each followed by an isready round trip, the way a game with
+pondering does. A fake UCI engine replays every position it receives, like an engine does before searching. Each
+position is sent with every move from the start of the game (`chess.uci.Engine.position`, the previous behaviour)
+and from the last capture or pawn move, extending the last command when moves were appended
+(`LeanEngine.position`). The benchmark reports the time per move and the length of the commands.
+
+usage: python benchmarks/bench_position.py [--plies 50 200 500] [--moves 20]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import chess  # noqa: E402
+import chess.uci  # noqa: E402
+
+from src.engine_wrapper import popen_uci_engine  # noqa: E402
+
+FAKE_ENGINE = r'''
+import sys
+
+import chess
+
+for line in sys.stdin:
+    command = line.split()
+    if not command:
+        continue
+    if command[0] == "uci":
+        print("id name replay\nuciok", flush=True)
+    elif command[0] == "isready":
+        print("readyok", flush=True)
+    elif command[0] == "position":
+        moves = command.index("moves") if "moves" in command else len(command)
+        board = chess.Board() if command[1] == "startpos" else chess.Board(" ".join(command[2:moves]))
+        for move in command[moves + 1:]:
+            board.push_uci(move)
+    elif command[0] == "quit":
+        break
+'''
+
+
+def play_game(plies, seed=1):
+    """A game of random moves that avoids captures and pawn moves when it can, like a long endgame shuffles."""
+    rng = random.Random(seed)
+    board = chess.Board()
+    while len(board.move_stack) < plies:
+        moves = list(board.legal_moves)
+        quiet = [move for move in moves if not board.is_zeroing(move)]
+        board.push(rng.choice(quiet if quiet and rng.random() < 0.9 else moves))
+        if board.is_game_over(claim_draw=False):
+            board.pop()
+            board.pop()
+    return board.move_stack
+
+
+def run(script, moves, plies, count, send):
+    engine = popen_uci_engine([sys.executable, script])
+    engine.uci()
+    board = chess.Board()
+    for move in moves[:plies]:
+        board.push(move)
+    characters = 0
+    elapsed = 0
+    for ply in range(plies, plies + 2 * count, 2):
+        ponder_board = board.copy()
+        ponder_board.push(moves[ply])
+        ponder_board.push(moves[ply + 1])
+        start = time.perf_counter()
+        for position in (board, ponder_board):
+            send(engine, position)
+            engine.isready()
+        elapsed += time.perf_counter() - start
+        characters += len(engine.sent_command or "")
+        board = ponder_board
+    engine.quit()
+    return {"ms per move": round(1000 * elapsed / count, 2), "characters per command": characters // count}
+
+
+def send_full(engine, board):
+    chess.uci.Engine.position(engine, board)
+    # the command chess.uci.Engine sends, to report its length.
+    engine.sent_command = "position startpos moves " + " ".join(move.uci() for move in board.move_stack)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the per-move cost of sending positions to the engine")
+    parser.add_argument("--plies", type=int, nargs="+", default=[50, 200, 500])
+    parser.add_argument("--moves", type=int, default=20, help="Moves measured from every ply count.")
+    args = parser.parse_args()
+
+    GAME = play_game(max(args.plies) + 2 * args.moves)
+    with tempfile.NamedTemporaryFile("w", suffix=".py", delete=False) as script_file:
+        script_file.write(FAKE_ENGINE)
+    try:
+        for PLIES in args.plies:
+            for NAME, SEND in (("full", send_full), ("incremental", lambda engine, board: engine.position(board))):
+                print("ply {:>4}, {:<11}: {}".format(PLIES, NAME, run(script_file.name, GAME, PLIES, args.moves,
+                                                                     SEND)))
+    finally:
+        os.remove(script_file.name)
@@ -2,23 +2,32 @@ import argparse
 import json
 import logging
 import multiprocessing
+import os
+import random
 import signal
-import threading
+import sys
 import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 
 import backoff
 import chess
 import chess.polyglot
+import requests
 from chess.variant import find_variant
 from requests.exceptions import ChunkedEncodingError, ConnectionError, HTTPError
 from urllib3.exceptions import ProtocolError
 
-from src import lichess, model, engine_wrapper, logging_pool
+from src import lichess, model, engine_wrapper, logging_pool, correspondence, openings, profiler, snapshots, \
+    status_table, memory
+from src.admission import AdmissionWorkers
+from src.admission_policy import nominal_seconds, record_challenge
+from src.account import Account, combined_metrics, format_metrics, format_route_metrics
 from src.color_logger import enable_color_logging
 from src.config import load_config
 from src.conversation import Conversation, ChatLine
+from src.move_executor import MoveExecutor
 
 logger = logging.getLogger(__name__)
 
@@ -30,14 +39,26 @@ except ImportError:
 
 __version__ = "1.2.3 [unofficial]"
 
+# upper bound (in seconds) of the jittered delay before reconnecting to the event stream, and the delay after Lichess
+# answered with 429 (too many requests), which asks for a full minute.
+STREAM_RECONNECT_MAX_DELAY = 60
+RATE_LIMIT_DELAY = 60
+
 terminated = False
 
+# restarted bots measure how long it takes until they move again in the games they resume.
+STARTED_AT = time.time()
+
+book_readers = {}
+opening_tables = {}
+
 
 def signal_handler(signal, frame):
     global terminated
     logger.debug("Received SIGINT. Terminating client.")
     terminated = True
     lichess.terminated = True
+    correspondence.terminated = True
 
 
 signal.signal(signal.SIGINT, signal_handler)
@@ -55,113 +76,336 @@ def upgrade_account(li):
     return True
 
 
-@backoff.on_exception(backoff.expo, BaseException, max_time=600, giveup=is_final)
-def watch_control_stream(control_queue, li):
-    response = li.get_event_stream()
-    try:
-        for line in response.iter_lines():
-            if line:
-                event = json.loads(line.decode('utf-8'))
+def watch_control_stream(control_queue, li, username):
+    attempts = 0
+    while not terminated:
+        rate_limited = False
+        try:
+            response = li.get_event_stream()
+            response.raise_for_status()
+            if attempts:
+                # events sent while we were disconnected are lost, let the control loop catch up.
+                control_queue.put_nowait({"type": "reconnected", "account": username})
+            for line in response.iter_lines():
+                attempts = 0
+                if line:
+                    event = json.loads(line.decode('utf-8'))
+                    if "type" not in event:
+                        logger.debug("Skipping event without a type: {}".format(event))
+                        continue
+                else:
+                    event = {"type": "ping"}
+                event["account"] = username
                 control_queue.put_nowait(event)
-            else:
-                control_queue.put_nowait({"type": "ping"})
-    except (RemoteDisconnected, ChunkedEncodingError, ConnectionError, ProtocolError) as exception:
-        logger.error("Terminating client due to connection error")
-        traceback.print_exception(type(exception), exception, exception.__traceback__)
-        control_queue.put_nowait({"type": "terminated"})
-
-
-def start(li, user_profile, engine_factory, config):
-    challenge_config = config["challenge"]
-    max_games = challenge_config.get("concurrency", 1)
-    logger.info("You're now connected to {} and awaiting challenges.".format(config["url"]))
-    manager = multiprocessing.Manager()
-    challenge_queue = manager.list()
+            logger.warning("Event stream closed by the server")
+        except (RemoteDisconnected, ChunkedEncodingError, ConnectionError, ProtocolError) as exception:
+            logger.error("Event stream lost due to connection error")
+            traceback.print_exception(type(exception), exception, exception.__traceback__)
+        except HTTPError as exception:
+            logger.error("Could not open the event stream: {}".format(exception))
+            rate_limited = exception.response.status_code == 429
+
+        attempts += 1
+        delay = random.uniform(0, min(STREAM_RECONNECT_MAX_DELAY, 2 ** attempts))
+        if rate_limited:
+            delay += RATE_LIMIT_DELAY
+        logger.info("Reconnecting to the event stream in {:.1f} seconds".format(delay))
+        time.sleep(delay)
+
+
+def reconcile_games(pool, account, control_queue, ongoing_games):
+    # resume every game that started while the event stream was down, as slots become free. any challenge Lichess
+    # already answered has either started (and is in the ongoing games) or expired, so only the accepts still waiting
+    # for an answer keep their queued slots.
+    for ongoing_game in ongoing_games:
+        game_id = ongoing_game["gameId"]
+        if is_correspondence_game(account, game_id, ongoing_game.get("speed")):
+            continue  # the correspondence scheduler finds these games by itself
+        account.accepting.discard(game_id)
+        if game_id not in account.active_games and game_id not in account.resume_queue:
+            account.resume_queue.append(game_id)
+    account.queued_processes = len(account.accepting)
+    resume_games(pool, account, control_queue)
+
+
+def resume_games(pool, account, control_queue):
+    while account.resume_queue and account.has_free_slot():
+        game_id = account.resume_queue.pop(0)
+        logger.info("    Resuming missed game {}".format(game_id))
+        start_game(pool, account, game_id, control_queue)
+
+
+def is_correspondence_game(account, game_id, speed):
+    """Whether the game is played by the correspondence scheduler rather than by a worker of the pool."""
+    if not account.plays_correspondence():
+        return False
+    return speed == "correspondence" or game_id in account.correspondence_pending or \
+        correspondence.is_saved(account.correspondence_config.get("dir", "./correspondence"), game_id)
+
+
+def start_game(pool, account, game_id, control_queue, prepare=False):
+    status_slot = account.status_table.claim(game_id) if account.status_table is not None else None
+    pool.apply_async(play_game, [account.li, game_id, control_queue, account.engine_factory, account.user_profile,
+                                 account.config, account.challenge_queue, status_slot,
+                                 account.accepted.pop(game_id, None), prepare])
+    account.accepting.discard(game_id)
+    account.active_games.add(game_id)
+    account.busy_processes += 1
+    account.games_started += 1
+
+
+def accept_correspondence_challenge(account, challenge, admission):
+    # correspondence games don't use a worker, so they are accepted right away up to their own limit.
+    games = correspondence.count_games(account.correspondence_config.get("dir", "./correspondence"))
+    if games + len(account.correspondence_pending) >= account.correspondence_config.get("max_games", 100):
+        logger.info("    Too many correspondence games to accept {}".format(challenge))
+        return
+    if admission.accept(account, challenge, "correspondence"):
+        account.correspondence_pending.add(challenge.id)
+
+
+def log_processes(prefix, account, accounts):
+    logger.info("{} [{}] Total Queued: {}. Total Used: {}".format(
+        prefix, account, account.queued_processes, account.busy_processes
+    ))
+    if len(accounts) > 1:
+        logger.info("    All accounts: {}".format(format_metrics(combined_metrics(accounts))))
+
+
+def handle_event(event, account, accounts, pool, control_queue, admission):
+    # nothing in here may wait for Lichess, accepts and declines are handed to the admission workers.
+    challenge_config = account.challenge_config
+
+    if event["type"] == "local_game_done":
+        account.active_games.discard(event["game_id"])
+        account.started_games.discard(event["game_id"])
+        if account.status_table is not None:
+            account.status_table.release(event["game_id"])
+        account.expected_durations.pop(event["game_id"], None)
+        account.busy_processes -= 1
+        account.games_finished += 1
+        account.record_route_stats(event["engine_stats"])
+        game_stats = event["game_stats"]
+        account.rss_growth += game_stats["rss_growth"]
+        account.policy.record_game(game_stats["speed"], game_stats["variant"], game_stats["nominal"],
+                                   game_stats["duration"], event["engine_stats"]["search_time"], game_stats["score"],
+                                   game_stats.get("opponent_rating"))
+        log_processes("+++ Process Free.", account, accounts)
+        logger.info("    Engine routes: {}".format(format_route_metrics(account.route_metrics)))
+        logger.info("    Worker {} uses {:.0f} MB, {:+.1f} MB during the game".format(
+            game_stats["pid"], memory.megabytes(game_stats["rss"]), memory.megabytes(game_stats["rss_growth"])))
+
+    elif event["type"] == "reconnected":
+        admission.fetch_ongoing_games(account)
+
+    elif event["type"] == "ongoingGames":
+        reconcile_games(pool, account, control_queue, event["games"])
+        log_processes("=== Reconciled.", account, accounts)
+
+    elif event["type"] == "challengeAccepted":
+        account.challenges_accepted += 1
+        if event["kind"] == "game":
+            account.accepting.discard(event["challenge"])
+            account.accept(event["challenge"], event["accepted"])
+            if challenge_config.get("prepare_games") and event["challenge"] not in account.active_games:
+                # the worker starts the engine right away and opens the game stream as soon as the game exists,
+                # its gameStart event is then ignored.
+                account.queued_processes -= 1
+                start_game(pool, account, event["challenge"], control_queue, prepare=True)
+                log_processes("--- Process Prepared.", account, accounts)
+
+    elif event["type"] == "local_game_released":
+        # a prepared game whose stream never opened. if its gameStart came meanwhile, it's started the usual way.
+        account.active_games.discard(event["game_id"])
+        account.expected_durations.pop(event["game_id"], None)
+        account.busy_processes -= 1
+        if account.status_table is not None:
+            account.status_table.release(event["game_id"])
+        log_processes("+++ Process Released.", account, accounts)
+        if event["game_id"] in account.started_games:
+            account.started_games.discard(event["game_id"])
+            start_game(pool, account, event["game_id"], control_queue)
+
+    elif event["type"] == "challengeAcceptFailed":
+        if event["kind"] == "correspondence":
+            account.correspondence_pending.discard(event["challenge"])
+        else:
+            account.accepting.discard(event["challenge"])
+            account.queued_processes -= 1
+            account.expected_durations.pop(event["challenge"], None)
+            log_processes("+++ Process Unqueued.", account, accounts)
+
+    elif event["type"] == "challenge":
+        if challenge_config.get("record"):
+            record_challenge(challenge_config["record"], event["challenge"])
+        challenge = model.Challenge(event["challenge"])
+        if account.plays_correspondence() and challenge.speed == "correspondence" and \
+                challenge.is_supported(challenge_config):
+            accept_correspondence_challenge(account, challenge, admission)
+        elif challenge.is_supported(challenge_config) and not challenge.is_ignore(challenge_config):
+            # the queue stays the shared list, so play_game gets a proxy to it rather than a copy of every challenge,
+            # and it's read and written once instead of once per challenge.
+            account.challenge_queue[:] = account.policy.rank(account.challenge_queue[:] + [challenge])
+        elif challenge.is_ignore(challenge_config):
+            return
+        else:
+            admission.decline(account, challenge)
+            account.challenges_declined += 1
+
+    elif event["type"] == "gameStart":
+        game_id = event["game"]["id"]
+        # lichess sends gameStart again for every ongoing game whenever the event stream connects.
+        if is_correspondence_game(account, game_id, event["game"].get("speed")):
+            account.correspondence_pending.discard(game_id)
+            return  # played by the correspondence scheduler
+        if game_id in account.active_games:
+            account.started_games.add(game_id)
+            return  # already started while reconciling after a reconnect, or prepared when it was accepted
+        if game_id in account.resume_queue:
+            return  # resumed when a slot is free
+        if account.queued_processes <= 0:
+            logger.debug("Something went wrong. Game is starting and we don't have a queued process")
+        else:
+            account.queued_processes -= 1
+        start_game(pool, account, game_id, control_queue)
+        log_processes("--- Process Used.", account, accounts)
+
+    # games found ongoing go before new challenges.
+    resume_games(pool, account, control_queue)
+
+    # keep processing the queue until empty or max_games is reached. the slot is reserved right away and released
+    # again if the accept fails.
+    while account.has_free_slot() and account.challenge_queue:
+        index = account.next_challenge()
+        if index is None:
+            break  # only long games are waiting and the remaining slots are kept for short ones
+        challenge = account.challenge_queue.pop(index)
+        if not admission.accept(account, challenge):
+            account.challenge_queue.insert(index, challenge)
+            break
+        account.queued_processes += 1
+        account.accepting.add(challenge.id)
+        account.expected_durations[challenge.id] = account.policy.expected_duration(challenge)
+        log_processes("--- Process Queue.", account, accounts)
+
+
+def start(accounts):
+    for account in accounts:
+        logger.info("{} is now connected to {} and awaiting challenges.".format(account, account.config["url"]))
+    accounts_by_name = {account.username: account for account in accounts}
+
+    # a single manager, control queue and pool are shared between every account. each account only adds its own
+    # control stream process, so running several accounts costs little more memory than running one.
+    manager = memory.BotManager()
+    manager.start()
     control_queue = manager.Queue()
-    control_stream = multiprocessing.Process(target=watch_control_stream, args=[control_queue, li])
-    control_stream.start()
-    busy_processes = 0
-    queued_processes = 0
-
-    with logging_pool.LoggingPool(max_games + 1) as pool:
+    control_streams = []
+    for account in accounts:
+        account.challenge_queue = manager.list()
+        control_stream = multiprocessing.Process(target=watch_control_stream,
+                                                 args=[control_queue, account.li, account.username])
+        control_stream.start()
+        control_streams.append(control_stream)
+        if account.plays_correspondence():
+            scheduler = multiprocessing.Process(target=correspondence.run_scheduler, args=[
+                account.li, account.username, account.engine_factory, setup_board, account.correspondence_config
+            ])
+            scheduler.start()
+            control_streams.append(scheduler)
+
+    if accounts[0].config.get("status_table"):
+        # one slot per worker of the pool.
+        table = status_table.StatusTable(accounts[0].config["status_table"],
+                                         sum(account.max_games for account in accounts) + 1)
+        for account in accounts:
+            account.status_table = table
+
+    challenge_config = accounts[0].challenge_config
+    admission = AdmissionWorkers(control_queue, challenge_config.get("admission_workers", 2),
+                                 challenge_config.get("admission_queue", 100))
+
+    workers_cfg = accounts[0].config.get("workers", {})
+    max_rss = workers_cfg.get("max_rss_mb", 0) * 1024 * 1024
+    compact_every = workers_cfg.get("compact_manager_every", 0)
+    with logging_pool.LoggingPool(sum(account.max_games for account in accounts) + 1,
+                                  workers_cfg.get("max_games") or None, max_rss or None) as pool:
+        # games in progress from before a restart are resumed right away instead of waiting for their next event.
+        for account in accounts:
+            admission.fetch_ongoing_games(account)
         while not terminated:
             event = control_queue.get()
-
             if event["type"] == "terminated":
                 break
-
-            elif event["type"] == "local_game_done":
-                busy_processes -= 1
-                logger.info(
-                    "+++ Process Free. Total Queued: {}. Total Used: {}".format(queued_processes, busy_processes)
-                )
-
-            elif event["type"] == "challenge":
-                challenge = model.Challenge(event["challenge"])
-                if challenge.is_supported(challenge_config) and not challenge.is_ignore(challenge_config):
-                    challenge_queue.append(challenge)
-                    if challenge_config.get("sort_by", "best") == "best":
-                        list_c = list(challenge_queue)
-                        list_c.sort(key=lambda c: -c.score())
-                        challenge_queue = list_c
-                elif challenge.is_ignore(challenge_config):
-                    continue
-                else:
-                    try:
-                        li.decline_challenge(challenge.id)
-                        logger.info("    Decline {}".format(challenge))
-                    except HTTPError as exception:
-                        if exception.response.status_code != 404:  # ignore missing challenge
-                            raise exception
-
-            elif event["type"] == "gameStart":
-                if queued_processes <= 0:
-                    logger.debug("Something went wrong. Game is starting and we don't have a queued process")
-                else:
-                    queued_processes -= 1
-                game_id = event["game"]["id"]
-                pool.apply_async(
-                    play_game, [li, game_id, control_queue, engine_factory, user_profile, config, challenge_queue]
-                )
-
-                busy_processes += 1
-                logger.info(
-                    "--- Process Used. Total Queued: {}. Total Used: {}".format(queued_processes, busy_processes)
-                )
-
-            # keep processing the queue until empty or max_games is reached
-            while (queued_processes + busy_processes) < max_games and challenge_queue:
-                challenge = challenge_queue.pop(0)
-                try:
-                    response = li.accept_challenge(challenge.id)
-                    logger.info("    Accept {}".format(challenge))
-                    queued_processes += 1
-                    logger.info(
-                        "--- Process Queue. Total Queued: {}. Total Used: {}".format(queued_processes, busy_processes)
-                    )
-                except HTTPError as exception:
-                    if exception.response.status_code == 404:  # ignore missing challenge
-                        logger.info("    Skip missing {}".format(challenge))
-                    else:
-                        raise exception
-
+            handle_event(event, accounts_by_name[event["account"]], accounts, pool, control_queue, admission)
+            if event["type"] == "local_game_done" and compact_every and \
+                    sum(account.games_finished for account in accounts) % compact_every == 0:
+                # the manager holds every challenge that went through the queues.
+                logger.info("    Manager uses {:.0f} MB after trimming its heap".format(
+                    memory.megabytes(manager.compact()._getvalue())))
+
+    admission.close()
     logger.info("Terminated")
-    control_stream.terminate()
-    control_stream.join()
+    for control_stream in control_streams:
+        control_stream.terminate()
+        control_stream.join()
 
 
 @backoff.on_exception(backoff.expo, BaseException, max_time=600, giveup=is_final)
-def play_game(li, game_id, control_queue, engine_factory, user_profile, config, challenge_queue):
-    response = li.get_game_stream(game_id)
+def play_game(li, game_id, control_queue, engine_factory, user_profile, config, challenge_queue, status_slot=None,
+              accepted=None, prepare=False):
+    rss_at_start = memory.rss()
+    snapshot_cfg = config.get("snapshots", {})
+    snapshot_dir = snapshot_cfg.get("dir", "./snapshots")
+    snapshot = snapshots.load(snapshot_dir, game_id) if snapshot_cfg.get("enabled") else None
+    engine_future = None
+    if snapshot is not None:
+        # a resumed game already knows its engine, so it starts while the game stream connects.
+        engine_future = ThreadPoolExecutor(1).submit(engine_factory, snapshots.snapshot_board(snapshot),
+                                                     snapshot["speed"], snapshot["variant_key"], snapshot["rating"])
+    elif prepare:
+        # so does a game whose challenge was just accepted, with the challenge's speed, variant and rating.
+        engine_future = ThreadPoolExecutor(1).submit(prepare_game, engine_factory, config, accepted)
+
+    if prepare:
+        try:
+            response = open_prepared_game_stream(li, game_id, config["challenge"].get("prepare_timeout", 30))
+        except Exception:
+            logger.info("    Releasing the engine prepared for {}".format(game_id))
+            try:
+                engine_future.result().quit()
+            except Exception:
+                logger.warning("    The engine prepared for {} did not start".format(game_id))
+            finally:
+                control_queue.put_nowait({"type": "local_game_released", "account": user_profile["username"],
+                                          "game_id": game_id})
+            return
+    else:
+        response = li.get_game_stream(game_id)
+        response.raise_for_status()
     lines = response.iter_lines()
 
     # Initial response of stream will be the full game info. Store it
     game = model.Game(json.loads(next(lines).decode('utf-8')), user_profile["username"], li.baseUrl,
                       config.get("abort_time", 20))
-    board = setup_board(game)
-    engine = engine_factory(board, game.speed)
+    game_start_time = time.time()
+    board = snapshots.restore_board(snapshot, game.state["moves"].split()) if snapshot is not None else None
+    if board is None:
+        snapshot = None
+        board = setup_board(game)
+    engine = engine_future.result() if engine_future is not None else None
+    if engine is not None and (type(engine.board) is not type(board) or engine.board.chess960 != board.chess960):
+        logger.info("    The engine was started for another variant, restarting it")
+        engine.quit()
+        engine = None
+    if engine is None:
+        engine = engine_factory(board, game.speed, game.variant_key, game.opponent.rating)
+    if snapshot is not None:
+        engine.restore_state(snapshot["engine"])
+        game.abort_at = snapshot["abort_at"]
+        logger.info("    Resuming {} from its snapshot".format(game.url()))
     conversation = Conversation(game, engine, li, __version__, challenge_queue, config.get("chat_commands", {}),
-                                user_profile["username"])
+                                user_profile["username"], config.get("profiler", {}).get("owner"))
+    profiler.set_tag(game.id)
 
     logger.info("+++ {}".format(game))
 
@@ -169,11 +413,86 @@ def play_game(li, game_id, control_queue, engine_factory, user_profile, config,
     polyglot_cfg = engine_cfg.get("polyglot", {})
     book_cfg = polyglot_cfg.get("book", {})
 
+    opening_table = open_opening_table(engine_cfg["opening_table"]) if engine_cfg.get("opening_table") else None
+    resumed_at = STARTED_AT if snapshot is not None else None
+
+    status = status_table.open_table(config["status_table"]) if status_slot is not None else None
+
+    def publish_status(state, latency=0):
+        my_clock = state["wtime"] if game.is_white else state["btime"]
+        opponent_clock = state["btime"] if game.is_white else state["wtime"]
+        score = engine.score_history[-1][1] if engine.score_history else None
+        status.write(status_slot, game.id, game.speed, my_clock, opponent_clock, len(state["moves"].split()), score,
+                     engine.last_search.get("depth"), engine.last_search.get("nps"), engine.is_pondering(), latency)
+
+    def play_first_move_function(board):
+        def first_move_function(request):
+            moved = polyglot_cfg.get("enabled") and play_first_book_move(game, engine, board, li, book_cfg,
+                                                                         opening_table)
+            if not moved:
+                moved = play_first_move(game, engine, board, li, opening_table)
+            if moved and accepted is not None and not game.state["moves"]:
+                logger.info("    First move {:.2f}s after the accept".format(time.time() - accepted["accepted_at"]))
+        return first_move_function
+
+    def play_move_function(board, upd):
+        moves = upd["moves"].split()
+        received_at = time.time()
+
+        def move_function(request):
+            nonlocal resumed_at
+            move_start_time = time.time()
+            best_move = None
+            if polyglot_cfg.get("enabled") and len(moves) <= polyglot_cfg.get("max_depth", 8) * 2 - 1:
+                best_move = get_book_move(board, book_cfg)
+            if best_move is None:
+                return_value = engine.search(board, upd["wtime"], upd["btime"], upd["winc"], upd["binc"])
+                request.searching = False
+                if engine.is_game_over or request.cancelled:
+                    return
+
+                # do this after making sure game not over
+                move, draw_offer, resign = return_value
+                try:
+                    if resign:
+                        li.resign(game.id)
+                    else:
+                        li.make_move(game.id, move, offering_draw=draw_offer)
+                except (HTTPError, ValueError):  # ValueError if engine closed.
+                    pass
+            elif not request.cancelled:
+                request.searching = False
+                li.make_move(game.id, best_move)
+            else:
+                return
+
+            game.abort_in(config.get("abort_time", 20))
+            if status is not None:
+                publish_status(upd, time.time() - received_at)
+            if snapshot_cfg.get("enabled"):
+                snapshots.save(snapshot_dir, game.id, snapshots.checkpoint(game, board, len(moves), engine))
+            if resumed_at is not None:
+                logger.info("    Moved {:.2f}s after the restart".format(time.time() - resumed_at))
+                resumed_at = None
+            if time.time() - move_start_time > move_budget(game, upd):
+                profiler.dump_recent()
+        return move_function
+
+    # every search runs on this thread, so the stream is never blocked by the engine or by fake think time.
+    move_executor = MoveExecutor(engine)
+
     try:
-        if not polyglot_cfg.get("enabled") or not play_first_book_move(game, engine, board, li, book_cfg):
-            play_first_move(game, engine, board, li)
+        first_move_function = play_first_move_function(board.copy())
+        if engine.did_first_move:
+            first_move_function = resume_function(game, engine, board.copy(), snapshot, play_move_function)
 
-        engine.set_time_control(game)
+        def setup_function(request):
+            first_move_function(request)
+            engine.set_time_control(game)
+
+        move_executor.submit(game.state["moves"], setup_function)
+        if status is not None:
+            publish_status(game.state)
 
         for binary_chunk in lines:
             upd = json.loads(binary_chunk.decode('utf-8')) if binary_chunk else None
@@ -188,45 +507,16 @@ def play_game(li, game_id, control_queue, engine_factory, user_profile, config,
                 board = update_board(board, moves[-1])
                 if not board.is_game_over() and is_engine_move(game, moves):
                     if not engine.did_first_move:
-                        if not polyglot_cfg.get("enabled") or \
-                                not play_first_book_move(game, engine, board, li, book_cfg):
-                            play_first_move(game, engine, board, li)
+                        move_executor.submit(upd["moves"], play_first_move_function(board.copy()))
                         continue
 
+                    delay = 0
                     if config.get("fake_think_time") and len(moves) > 9:
                         delay = min(game.clock_initial, game.my_remaining_seconds()) * 0.015
                         accel = 1 - max(0, min(100, len(moves) - 20)) / 150
-                        sleep = min(5, delay * accel)
-                        time.sleep(sleep)
-
-                    best_move = None
-                    if polyglot_cfg.get("enabled") and len(moves) <= polyglot_cfg.get("max_depth", 8) * 2 - 1:
-                        best_move = get_book_move(board, book_cfg)
-                    if best_move is None:
-                        def move_function():
-                            return_value = engine.search(board, upd["wtime"], upd["btime"], upd["winc"],
-                                                         upd["binc"])
-                            if engine.is_game_over:
-                                return
-
-                            # do this after making sure game not over
-                            move, draw_offer, resign = return_value
-                            try:
-                                if resign:
-                                    li.resign(game.id)
-                                else:
-                                    li.make_move(game.id, move, offering_draw=draw_offer)
-                            except (HTTPError, ValueError):  # ValueError if engine closed.
-                                pass
-
-                            game.abort_in(config.get("abort_time", 20))
-
-                        move_thread = threading.Thread(target=move_function)
-                        move_thread.start()
-                        continue
+                        delay = min(5, delay * accel)
 
-                    li.make_move(game.id, best_move)
-                    game.abort_in(config.get("abort_time", 20))
+                    move_executor.submit(upd["moves"], play_move_function(board.copy(), upd), delay)
 
             elif u_type == "ping":
                 if game.should_abort_now():
@@ -245,23 +535,129 @@ def play_game(li, game_id, control_queue, engine_factory, user_profile, config,
     finally:
         logger.info("--- {} Game over".format(game.url()))
         engine.is_game_over = True
+        move_executor.close()
+        speculation_stats = engine.get_speculation_stats()
+        if speculation_stats:
+            logger.info("    Speculative ponder: {hits}/{lookups} hits ({hit_rate:.0%}) for {search_time:.1f}s of "
+                        "helper engine time".format(**speculation_stats))
+        node_budget_stats = engine.get_node_budget_stats()
+        if node_budget_stats:
+            logger.info("    Node budget: stopped {early_stops}/{searches} searches early, used {budget_used:.0%} of "
+                        "the budgeted nodes".format(**node_budget_stats))
+        ponder_stats = engine.get_ponder_stats()
+        if ponder_stats:
+            logger.info("    Ponder: {hits}/{searches} hits ({hit_rate:.0%})".format(**ponder_stats))
+        info_line_stats = engine.get_info_line_stats()
+        if info_line_stats:
+            logger.debug("    Parsed {parsed_lines} of {info_lines} engine info lines".format(**info_line_stats))
+        if engine.recoveries:
+            logger.info("    Engine restarted {} times, {:.2f}s at most".format(len(engine.recoveries),
+                                                                             max(engine.recoveries)))
         engine.quit()
+        if engine_cfg.get("score_history"):
+            save_score_history(engine_cfg["score_history"], game, engine)
+        if snapshot_cfg.get("enabled") and game.state.get("status", "started") not in ("created", "started"):
+            snapshots.remove(snapshot_dir, game.id)
         # This can raise queue.NoFull, but that should only happen if we're not processing
         # events fast enough and in this case I believe the exception should be raised
-        control_queue.put_nowait({"type": "local_game_done"})
+        profiler.set_tag("idle")
+        # whatever the game left behind is what the next game in this worker starts with.
+        rss = memory.compact()
+        control_queue.put_nowait({"type": "local_game_done", "account": user_profile["username"], "game_id": game_id,
+                                  "engine_stats": engine.get_route_stats(), "game_stats": {
+                                      "speed": game.speed,
+                                      "variant": game.variant_key,
+                                      "nominal": nominal_seconds(game.speed, game.clock_initial / 1000,
+                                                                 game.clock_increment / 1000),
+                                      "duration": time.time() - game_start_time,
+                                      "score": game.result(),
+                                      "opponent_rating": game.opponent.rating,
+                                      "pid": os.getpid(),
+                                      "rss": rss,
+                                      "rss_growth": rss - rss_at_start,
+                                  }})
+
+
+def prepared_board(variant):
+    """An empty board of the variant of a challenge, for starting its engine before the game exists."""
+    if variant == "chess960":
+        return chess.Board(chess960=True)
+    try:
+        return find_variant("King of the Hill" if variant == "kingOfTheHill" else variant)()
+    except ValueError:
+        return chess.Board()  # e.g. fromPosition
+
+
+def prepare_game(engine_factory, config, accepted):
+    engine_cfg = config["engine"]
+    if engine_cfg.get("opening_table"):
+        open_opening_table(engine_cfg["opening_table"])
+    return engine_factory(prepared_board(accepted["variant"]), accepted["speed"], accepted["variant"],
+                          accepted["rating"])
+
+
+def open_prepared_game_stream(li, game_id, timeout):
+    """The stream of a game whose challenge was just accepted, retried until the game exists or `timeout` seconds
+    have passed."""
+    deadline = time.time() + timeout
+    while True:
+        # the stream of a game that doesn't exist yet is a 404 response, it isn't raised.
+        response = li.get_game_stream(game_id)
+        if response.status_code != 404 or time.time() > deadline:
+            response.raise_for_status()
+            return response
+        response.close()
+        time.sleep(1)
+
+
+def resume_function(game, engine, board, snapshot, play_move_function):
+    moves = game.state["moves"].split()
+
+    def function(request):
+        if is_engine_move(game, moves):
+            play_move_function(board, game.state)(request)
+            return
+        # keep pondering on the expected reply if the opponent hasn't moved since the snapshot.
+        ponder_move = snapshot["engine"]["ponder_move"]
+        if ponder_move and len(moves) == snapshot["ply"] + 1 and chess.Move.from_uci(ponder_move) in board.legal_moves:
+            state = game.state
+            engine.resume_ponder(board, chess.Move.from_uci(ponder_move), state["wtime"], state["btime"],
+                                 state["winc"], state["binc"])
+    return function
+
+
+def move_budget(game, state):
+    # roughly what an engine spends per move, used to spot moves that took too long.
+    remaining = (state["wtime"] if game.is_white else state["btime"]) / 1000
+    return remaining / 30 + game.clock_increment / 1000
 
 
-def play_first_move(game, engine, board, li):
+def save_score_history(path, game, engine):
+    result = game.result()
+    if result is None or not engine.score_history:
+        return
+    record = {"id": game.id, "speed": game.speed, "color": game.my_color, "result": result,
+              "moves": engine.score_history}
+    with open(path, "a") as history_file:
+        history_file.write(json.dumps(record) + "\n")
+
+
+def play_first_move(game, engine, board, li, opening_table=None):
     moves = game.state["moves"].split()
     if is_engine_move(game, moves):
-        # need to hard code first movetime since Lichess has 30 sec limit.
-        best_move = engine.first_search(board, 10000)
+        best_move = openings.lookup(opening_table, board) if opening_table else None
+        if best_move is not None:
+            logger.info("Got move {} from the opening table".format(best_move))
+            engine.did_first_move = True
+        else:
+            # need to hard code first movetime since Lichess has 30 sec limit.
+            best_move = engine.first_search(board, 10000)
         li.make_move(game.id, best_move)
         return True
     return False
 
 
-def play_first_book_move(game, engine, board, li, config):
+def play_first_book_move(game, engine, board, li, config, opening_table=None):
     moves = game.state["moves"].split()
     if is_engine_move(game, moves):
         book_move = get_book_move(board, config)
@@ -269,10 +665,27 @@ def play_first_book_move(game, engine, board, li, config):
             li.make_move(game.id, book_move)
             return True
         else:
-            return play_first_move(game, engine, board, li)
+            return play_first_move(game, engine, board, li, opening_table)
     return False
 
 
+def open_opening_table(path):
+    # loaded once per worker process, like the polyglot books.
+    if path not in opening_tables:
+        opening_tables[path] = openings.load_table(path)
+    return opening_tables[path]
+
+
+def open_book(book):
+    # readers are kept open for the lifetime of the worker process and shared by every game (and account) that
+    # runs in it, instead of reopening the book file on every move.
+    reader = book_readers.get(book)
+    if reader is None:
+        reader = chess.polyglot.open_reader(book)
+        book_readers[book] = reader
+    return reader
+
+
 def get_book_move(board, config):
     if board.uci_variant == "chess":
         book = config["standard"]
@@ -282,18 +695,18 @@ def get_book_move(board, config):
         else:
             return None
 
-    with chess.polyglot.open_reader(book) as reader:
-        try:
-            selection = config.get("selection", "weighted_random")
-            if selection == "weighted_random":
-                move = reader.weighted_choice(board).move()
-            elif selection == "uniform_random":
-                move = reader.choice(board, minimum_weight=config.get("min_weight", 1)).move()
-            elif selection == "best_move":
-                move = reader.find(board, minimum_weight=config.get("min_weight", 1)).move()
-        except IndexError:
-            # python-chess raises "IndexError" if no entries found
-            move = None
+    reader = open_book(book)
+    try:
+        selection = config.get("selection", "weighted_random")
+        if selection == "weighted_random":
+            move = reader.weighted_choice(board).move()
+        elif selection == "uniform_random":
+            move = reader.choice(board, minimum_weight=config.get("min_weight", 1)).move()
+        elif selection == "best_move":
+            move = reader.find(board, minimum_weight=config.get("min_weight", 1)).move()
+    except IndexError:
+        # python-chess raises "IndexError" if no entries found
+        move = None
 
     if move is not None:
         logger.info("Got move {} from book {}".format(move, book))
@@ -344,29 +757,50 @@ if __name__ == "__main__":
     multiprocessing.freeze_support()
 
     parser = argparse.ArgumentParser(description='Play on Lichess with a bot')
+    parser.add_argument('command', nargs='?', choices=['top'],
+                        help='"top" shows the games in progress of a running bot (needs `status_table`).')
     parser.add_argument('-u', action='store_true', help='Add this flag to upgrade your account to a bot account.')
     parser.add_argument('-v', action='store_true', help='Verbose output. Changes log level from INFO to DEBUG.')
-    parser.add_argument('--config', help='Specify a configuration file (defaults to ./config.yml)')
+    parser.add_argument('--config', action='append',
+                        help='Specify a configuration file (defaults to ./config.yml). Repeat to run several '
+                             'accounts from one process tree.')
     parser.add_argument('-l', '--logfile', help="Log file to append logs to.", default=None)
+    parser.add_argument('--interval', type=float, default=1, help='Seconds between refreshes of top.')
+    parser.add_argument('--once', action='store_true', help='Print the games in progress once and exit.')
     args = parser.parse_args()
 
+    if args.command == "top":
+        STATUS_TABLE = load_config((args.config or ["./config.yml"])[0]).get("status_table")
+        if not STATUS_TABLE:
+            parser.error("Set `status_table` in config.yml to watch the games in progress.")
+        signal.signal(signal.SIGINT, signal.SIG_DFL)  # nothing to clean up
+        status_table.top(STATUS_TABLE, args.interval, args.once)
+        sys.exit()
+
     logging.basicConfig(level=logging.DEBUG if args.v else logging.INFO, filename=args.logfile,
                         format="%(asctime)-15s: %(message)s")
     enable_color_logging(debug_lvl=logging.DEBUG if args.v else logging.INFO)
     logger.info(intro())
-    CONFIG = load_config(args.config or "./config.yml")
-    li = lichess.Lichess(CONFIG["token"], CONFIG["url"], __version__)
-
-    user_profile = li.get_profile()
-    username = user_profile["username"]
-    is_bot = user_profile.get("title") == "BOT"
-    logger.info("Welcome {}!".format(username))
-
-    if args.u is True and is_bot is False:
-        is_bot = upgrade_account(li)
+    session = requests.Session()
+    accounts = []
+    for config_file in args.config or ["./config.yml"]:
+        CONFIG = load_config(config_file)
+        li = lichess.Lichess(CONFIG["token"], CONFIG["url"], __version__, session, CONFIG.get("record_streams"))
+
+        user_profile = li.get_profile()
+        username = user_profile["username"]
+        is_bot = user_profile.get("title") == "BOT"
+        logger.info("Welcome {}!".format(username))
+
+        if args.u is True and is_bot is False:
+            is_bot = upgrade_account(li)
+
+        if is_bot:
+            engine_factory = partial(engine_wrapper.create_engine, CONFIG)
+            accounts.append(Account(li, user_profile, engine_factory, CONFIG))
+        else:
+            logger.error("{} is not a bot account. Please upgrade it to a bot account!".format(username))
 
-    if is_bot:
-        engine_factory = partial(engine_wrapper.create_engine, CONFIG)
-        start(li, user_profile, engine_factory, CONFIG)
-    else:
-        logger.error("{} is not a bot account. Please upgrade it to a bot account!".format(user_profile["username"]))
+    if accounts:
+        profiler.setup(accounts[0].config.get("profiler", {}))
+        start(accounts)
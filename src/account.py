@@ -0,0 +1,114 @@
+from src.admission_policy import AdmissionPolicy
+
+
+class Account:
+    def __init__(self, li, user_profile, engine_factory, config):
+        self.li = li
+        self.user_profile = user_profile
+        self.username = user_profile["username"]
+        self.engine_factory = engine_factory
+        self.config = config
+        self.challenge_config = config["challenge"]
+        self.max_games = self.challenge_config.get("concurrency", 1)
+        self.correspondence_config = config.get("correspondence", {})
+        self.correspondence_pending = set()
+        self.policy = AdmissionPolicy(self.challenge_config, user_profile.get("perfs", {}))
+        # expected seconds of every accepted or running game, by id.
+        self.expected_durations = {}
+
+        self.challenge_queue = []
+        # shared with the other accounts, see `src.status_table`.
+        self.status_table = None
+        self.active_games = set()
+        # games whose gameStart came while they were already running, see `handle_event`.
+        self.started_games = set()
+        # challenge id -> speed, variant, rating and time of the accepted challenges that haven't started yet.
+        self.accepted = {}
+        # challenge ids whose accept is queued or waiting for Lichess, each holds one of the queued slots.
+        self.accepting = set()
+        # ongoing games found when (re)connecting that wait for a free slot.
+        self.resume_queue = []
+        self.busy_processes = 0
+        self.queued_processes = 0
+
+        self.games_started = 0
+        self.games_finished = 0
+        self.challenges_accepted = 0
+        self.challenges_declined = 0
+        self.route_metrics = {}
+        # bytes the RSS of the workers grew during the games, to catch leaks.
+        self.rss_growth = 0
+
+    def has_free_slot(self):
+        return (self.queued_processes + self.busy_processes) < self.max_games
+
+    def accept(self, challenge_id, accepted):
+        # challenges accepted over an hour ago won't start anymore.
+        self.accepted = {key: value for key, value in self.accepted.items()
+                         if accepted["accepted_at"] - value["accepted_at"] < 3600}
+        self.accepted[challenge_id] = accepted
+
+    def long_games(self):
+        return sum(1 for duration in self.expected_durations.values() if self.policy.is_long(duration))
+
+    def next_challenge(self):
+        """The index in the queue of the first challenge the policy admits now, or None."""
+        long_games = self.long_games()
+        for index, challenge in enumerate(self.challenge_queue[:]):
+            if self.policy.can_admit(challenge, long_games, self.max_games):
+                return index
+        return None
+
+    def record_route_stats(self, stats):
+        metrics = self.route_metrics.setdefault(stats["route"], {"games": 0, "searches": 0, "search_time": 0,
+                                                                 "nodes": 0, "restarts": 0, "recovery_time": 0})
+        metrics["games"] += 1
+        metrics["searches"] += stats["searches"]
+        metrics["search_time"] += stats["search_time"]
+        metrics["nodes"] += stats["nodes"]
+        metrics["restarts"] += stats.get("restarts", 0)
+        metrics["recovery_time"] += stats.get("recovery_time", 0)
+
+    def plays_correspondence(self):
+        return self.correspondence_config.get("enabled", False)
+
+    def metrics(self):
+        return {
+            "queued": self.queued_processes,
+            "busy": self.busy_processes,
+            "started": self.games_started,
+            "finished": self.games_finished,
+            "accepted": self.challenges_accepted,
+            "declined": self.challenges_declined,
+        }
+
+    def __str__(self):
+        return self.username
+
+    def __repr__(self):
+        return self.__str__()
+
+
+def combined_metrics(accounts):
+    totals = {}
+    for account in accounts:
+        for name, value in account.metrics().items():
+            totals[name] = totals.get(name, 0) + value
+    return totals
+
+
+def format_metrics(metrics):
+    return ", ".join("{}: {}".format(name.capitalize(), value) for name, value in metrics.items())
+
+
+def format_route_metrics(route_metrics):
+    routes = []
+    for route, metrics in route_metrics.items():
+        nps = metrics["nodes"] / metrics["search_time"] if metrics["search_time"] else 0
+        latency = metrics["search_time"] / metrics["searches"] if metrics["searches"] else 0
+        route_str = "{} ({} games, {:.0f} nps, {:.2f}s per move".format(route, metrics["games"], nps, latency)
+        if metrics["restarts"]:
+            route_str += ", {} engine restarts, {:.2f}s per restart".format(
+                metrics["restarts"], metrics["recovery_time"] / metrics["restarts"])
+        routes.append(route_str + ")")
+    return ", ".join(routes)
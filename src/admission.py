@@ -0,0 +1,106 @@
+import logging
+import queue
+import threading
+import time
+
+from requests.exceptions import HTTPError
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionWorkers:
+    """Accepts and declines challenges on background threads so the control loop never waits for Lichess.
+
+    The outcome of every accept is posted back to the control queue as a `challengeAccepted` or
+    `challengeAcceptFailed` event. Declines are best effort: when the decline queue is full (e.g. during a challenge
+    storm) the challenge is left to expire instead. The ongoing games are fetched here as well and posted back as an
+    `ongoingGames` event."""
+
+    def __init__(self, control_queue, workers=2, max_queued=100):
+        self.control_queue = control_queue
+        self.accept_queue = queue.Queue(max_queued)
+        self.decline_queue = queue.Queue(max_queued)
+        self.ongoing_queue = queue.Queue()
+        self.workers = workers
+        self.threads = []
+        for _ in range(workers):
+            self._start_thread(self.accept_queue, self._accept)
+            self._start_thread(self.decline_queue, self._decline)
+        self._start_thread(self.ongoing_queue, self._fetch_ongoing_games)
+
+    def _start_thread(self, task_queue, handler):
+        thread = threading.Thread(target=self._work, args=[task_queue, handler], daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def accept(self, account, challenge, kind="game"):
+        """Returns False if the accept queue is full, in which case the challenge should be retried later."""
+        try:
+            self.accept_queue.put_nowait((account, challenge, kind))
+            return True
+        except queue.Full:
+            return False
+
+    def decline(self, account, challenge):
+        try:
+            self.decline_queue.put_nowait((account, challenge))
+        except queue.Full:
+            logger.debug("Decline queue is full, not declining {}".format(challenge))
+
+    def fetch_ongoing_games(self, account):
+        self.ongoing_queue.put_nowait((account,))
+
+    def close(self):
+        # the threads are daemons, so any task still queued when the bot terminates is simply dropped.
+        for _ in range(self.workers):
+            for task_queue in (self.accept_queue, self.decline_queue, self.ongoing_queue):
+                try:
+                    task_queue.put_nowait(None)
+                except queue.Full:
+                    pass
+
+    @staticmethod
+    def _work(task_queue, handler):
+        while True:
+            task = task_queue.get()
+            if task is None:
+                return
+            handler(*task)
+
+    def _accept(self, account, challenge, kind):
+        event = {"type": "challengeAcceptFailed", "account": account.username, "challenge": challenge.id,
+                 "kind": kind}
+        try:
+            account.li.accept_challenge(challenge.id)
+            logger.info("    Accept {}".format(challenge))
+            event["type"] = "challengeAccepted"
+            # what a worker needs to start the engine before the game starts.
+            event["accepted"] = {"accepted_at": time.time(), "speed": challenge.speed, "variant": challenge.variant,
+                                 "rating": challenge.challenger_rating_int}
+        except HTTPError as exception:
+            if exception.response.status_code == 404:  # ignore missing challenge
+                logger.info("    Skip missing {}".format(challenge))
+            else:
+                logger.error("Could not accept {}: {}".format(challenge, exception))
+        except Exception as exception:
+            logger.error("Could not accept {}: {}".format(challenge, exception))
+        self.control_queue.put_nowait(event)
+
+    def _fetch_ongoing_games(self, account):
+        try:
+            games = account.li.get_ongoing_games()
+        except Exception as exception:
+            logger.error("Could not get the ongoing games of {}: {}".format(account, exception))
+            return
+        self.control_queue.put_nowait({"type": "ongoingGames", "account": account.username, "games": games})
+
+    @staticmethod
+    def _decline(account, challenge):
+        try:
+            account.li.decline_challenge(challenge.id)
+            logger.info("    Decline {}".format(challenge))
+        except HTTPError as exception:
+            if exception.response.status_code != 404:  # ignore missing challenge
+                logger.error("Could not decline {}: {}".format(challenge, exception))
+        except Exception as exception:
+            logger.error("Could not decline {}: {}".format(challenge, exception))
@@ -0,0 +1,223 @@
+"""
+Which queued challenges to accept first, based on how long the games are expected to take.
+
+Every challenge gets an expected wall-clock duration and CPU cost from its time control, adjusted by what the finished
+games of the same speed and variant actually took, and a value under the configured objective (`challenge.sort_by`):
+
+  games   maximise games per hour, shortest games first
+  rating  maximise the expected rating gain per CPU hour, where the gain against a challenger is how much better we
+          are expected to score than the ratings predict. our strength is our rating adjusted by how our recorded
+          games scored against what the ratings expected, so every rated game is worth the same until there's
+          some history. challenges expected to lose rating rank with the unrated ones, as if worth nothing
+  best    the challenger's rating with a bonus for rated and titled games (the old default)
+  first   first come, first served
+
+Slots can also be reserved for short games, so long games can't take every slot while short ones are waiting.
+
+The challenges can be recorded (`challenge.record`) and replayed offline to compare the objectives:
+
+usage: python -m src.admission_policy challenges.jsonl [--concurrency 4] [--patience 60] [--rating 2000]
+"""
+
+import argparse
+import json
+import logging
+import math
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+OBJECTIVES = ("games", "rating", "best", "first")
+
+# typical clock in seconds when a challenge has no time control.
+SPEED_SECONDS = {"ultraBullet": 15, "bullet": 60, "blitz": 300, "rapid": 900, "classical": 1800,
+                 "correspondence": 3600 * 24 * 3}
+
+# moves per side used to turn the increment into time, and the share of both clocks a game uses before there's
+# any history for its speed and variant.
+EXPECTED_MOVES = 40
+DEFAULT_CLOCK_USAGE = 0.75
+# share of the game spent searching (our clock only, less the time of book moves).
+DEFAULT_CPU_SHARE = 0.45
+
+ELO_K = 20
+MIN_HISTORY = 3
+
+
+def nominal_seconds(speed, limit, increment):
+    """Both clocks in full, in seconds."""
+    if limit is None or limit < 0:
+        limit = SPEED_SECONDS.get(speed, SPEED_SECONDS["classical"])
+    return 2 * (limit + EXPECTED_MOVES * max(increment, 0))
+
+
+def expected_score(rating, opponent_rating):
+    return 1 / (1 + 10 ** ((opponent_rating - rating) / 400))
+
+
+def record_challenge(path, challenge_json):
+    with open(path, "a") as record_file:
+        record_file.write(json.dumps({"time": time.time(), "challenge": challenge_json}) + "\n")
+
+
+class AdmissionPolicy:
+    def __init__(self, config, perfs=None):
+        self.objective = config.get("sort_by", "best")
+        if self.objective not in OBJECTIVES:
+            raise ValueError("challenge.sort_by must be one of {}".format(", ".join(OBJECTIVES)))
+        self.short_game_slots = config.get("short_game_slots", 0)
+        self.long_game_seconds = config.get("long_game_minutes", 20) * 60
+        self.perfs = perfs or {}
+        # (speed, variant) -> totals of the finished games.
+        self.history = {}
+
+    def record_game(self, speed, variant, nominal, duration, cpu_time, score, opponent_rating=None):
+        totals = self.history.setdefault((speed, variant), {"games": 0, "nominal": 0, "duration": 0,
+                                                            "cpu_time": 0, "scored": 0, "score": 0, "expected": 0})
+        totals["games"] += 1
+        totals["nominal"] += nominal
+        totals["duration"] += duration
+        totals["cpu_time"] += cpu_time
+        if score is not None and opponent_rating:
+            totals["scored"] += 1
+            totals["score"] += score
+            totals["expected"] += expected_score(self._own_rating(speed, variant), opponent_rating)
+
+    def _history(self, challenge):
+        totals = self.history.get((challenge.speed, challenge.variant))
+        return totals if totals and totals["games"] >= MIN_HISTORY else None
+
+    def expected_duration(self, challenge):
+        nominal = nominal_seconds(challenge.speed, challenge.limit, challenge.increment)
+        totals = self._history(challenge)
+        usage = totals["duration"] / totals["nominal"] if totals and totals["nominal"] else DEFAULT_CLOCK_USAGE
+        return nominal * usage
+
+    def expected_cpu_time(self, challenge):
+        totals = self._history(challenge)
+        share = totals["cpu_time"] / totals["duration"] if totals and totals["duration"] else DEFAULT_CPU_SHARE
+        return self.expected_duration(challenge) * share
+
+    def _own_rating(self, speed, variant):
+        perf = self.perfs.get(speed if variant == "standard" else variant, {})
+        return perf.get("rating", 1500)
+
+    def own_rating(self, challenge):
+        return self._own_rating(challenge.speed, challenge.variant)
+
+    def rating_offset(self, challenge):
+        """How many Elo points stronger than our rating we played in the recorded games of the speed and variant."""
+        totals = self._history(challenge)
+        if not totals or not totals["scored"]:
+            return 0
+        score = min(max(totals["score"] / totals["scored"], 0.01), 0.99)
+        expected = min(max(totals["expected"] / totals["scored"], 0.01), 0.99)
+        return 400 * (math.log10(score / (1 - score)) - math.log10(expected / (1 - expected)))
+
+    def expected_rating_gain(self, challenge):
+        """K times our expected score against the challenger, at our strength, less the score our rating expects."""
+        if not challenge.rated:
+            return 0
+        own_rating = self.own_rating(challenge)
+        opponent_rating = challenge.challenger_rating_int or 1500
+        return ELO_K * (expected_score(own_rating + self.rating_offset(challenge), opponent_rating)
+                        - expected_score(own_rating, opponent_rating))
+
+    def priority(self, challenge):
+        if self.objective == "games":
+            return 1 / self.expected_duration(challenge)
+        if self.objective == "rating":
+            # a loss isn't smaller for taking longer: games expected to lose rating rank with the unrated ones, in the
+            # order they came.
+            return max(self.expected_rating_gain(challenge), 0) / max(self.expected_cpu_time(challenge), 1)
+        if self.objective == "best":
+            return challenge.score()
+        return 0
+
+    def rank(self, challenges):
+        """The challenges in the order to accept them. The sort is stable, so equal priorities keep their order."""
+        if self.objective == "first":
+            return list(challenges)
+        return sorted(challenges, key=lambda c: -self.priority(c))
+
+    def is_long(self, expected_duration):
+        return expected_duration > self.long_game_seconds
+
+    def can_admit(self, challenge, long_games, max_games):
+        """Long games may only use the slots not reserved for short games."""
+        if not self.is_long(self.expected_duration(challenge)):
+            return True
+        return long_games < max_games - self.short_game_slots
+
+
+def simulate(records, policy, concurrency, patience, seed=0):
+    """Replays the recorded challenges against `concurrency` slots. A challenge not accepted within `patience`
+    seconds is cancelled by the challenger. Games last their expected duration with some noise."""
+    from src.model import Challenge
+
+    rng = random.Random(seed)
+    arrivals = sorted(((record["time"], Challenge(record["challenge"])) for record in records), key=lambda a: a[0])
+    games = []  # (end time, is long)
+    waiting = []  # (arrival time, challenge)
+    totals = {"played": 0, "expired": 0, "wait": 0, "cpu_time": 0, "rating": 0}
+
+    def admit(now):
+        games[:] = [game for game in games if game[0] > now]
+        still_waiting = [item for item in waiting if now - item[0] <= patience]
+        totals["expired"] += len(waiting) - len(still_waiting)
+        waiting[:] = still_waiting
+        while len(games) < concurrency and waiting:
+            long_games = sum(1 for _, is_long in games if is_long)
+            ranked = policy.rank([challenge for _, challenge in waiting])
+            chosen = next((c for c in ranked if policy.can_admit(c, long_games, concurrency)), None)
+            if chosen is None:
+                return
+            arrival = next(item for item in waiting if item[1] is chosen)
+            waiting.remove(arrival)
+            expected = policy.expected_duration(chosen)
+            duration = expected * rng.lognormvariate(0, 0.3)
+            games.append((now + duration, policy.is_long(expected)))
+            totals["played"] += 1
+            totals["wait"] += now - arrival[0]
+            totals["cpu_time"] += duration * policy.expected_cpu_time(chosen) / expected
+            totals["rating"] += policy.expected_rating_gain(chosen)
+
+    for arrival_time, challenge in arrivals:
+        # games ending before the next challenge free their slots at their end time.
+        while games and min(games)[0] <= arrival_time:
+            admit(min(games)[0])
+        waiting.append((arrival_time, challenge))
+        admit(arrival_time)
+    while games and waiting:
+        admit(min(games)[0])
+
+    start = arrivals[0][0] if arrivals else 0
+    end = max([game[0] for game in games] + [arrivals[-1][0] if arrivals else 0])
+    hours = max(end - start, 1) / 3600
+    played = totals["played"]
+    return {
+        "objective": policy.objective,
+        "played": played,
+        "expired": totals["expired"] + len(waiting),
+        "games per hour": round(played / hours, 2),
+        "rating per cpu hour": round(totals["rating"] / (totals["cpu_time"] / 3600), 2) if totals["cpu_time"] else 0,
+        "mean wait s": round(totals["wait"] / played, 1) if played else 0,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare challenge admission objectives on recorded challenges')
+    parser.add_argument('records', help='Challenges recorded with challenge.record.')
+    parser.add_argument('--concurrency', type=int, default=1, help='Games played at the same time.')
+    parser.add_argument('--patience', type=float, default=60, help='Seconds before a challenger gives up.')
+    parser.add_argument('--short-game-slots', type=int, default=0, help='Slots reserved for short games.')
+    parser.add_argument('--rating', type=int, default=1500, help='Our rating in every perf.')
+    args = parser.parse_args()
+
+    with open(args.records) as records_file:
+        RECORDS = [json.loads(line) for line in records_file if line.strip()]
+    PERFS = {speed: {"rating": args.rating} for speed in SPEED_SECONDS}
+    for objective in OBJECTIVES:
+        POLICY = AdmissionPolicy({"sort_by": objective, "short_game_slots": args.short_game_slots}, PERFS)
+        print(simulate(RECORDS, POLICY, args.concurrency, args.patience))
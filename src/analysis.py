@@ -0,0 +1,180 @@
+"""
+Offline batch analysis of recorded games.
+
+Positions are streamed from PGN files and fanned out over a pool of engine processes which all use the engine
+configured in config.yml. Every position is searched with a fixed node and/or depth budget so results do not depend on
+the load of the machine. The results are collected in NumPy arrays for vectorized statistics.
+
+usage: python -m src.analysis games.pgn [more.pgn ...] --nodes 200000 --workers 4
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import time
+
+import chess
+import chess.pgn
+import chess.uci
+import numpy as np
+
+from src.config import load_config
+from src.engine_wrapper import MATE_SCORE, parse_configs, popen_uci_engine
+from src.openings import NO_MOVE, encode_move
+
+logger = logging.getLogger(__name__)
+
+# mate scores are clipped to this value (in centipawns) so they don't dominate the statistics.
+MATE_CLIP = 10000
+
+engine = None
+info_handler = None
+search_budget = {}
+
+
+def iter_positions(pgn_paths, max_plies=None):
+    """Yields (game index, ply, board) for every position in the given PGN files without loading them in memory."""
+    game_index = 0
+    for pgn_path in pgn_paths:
+        with open(pgn_path) as pgn:
+            while True:
+                game = chess.pgn.read_game(pgn)
+                if game is None:
+                    break
+                board = game.board()
+                for move in game.mainline_moves():
+                    if max_plies is not None and len(board.move_stack) >= max_plies:
+                        break
+                    yield game_index, len(board.move_stack), board.copy(stack=False)
+                    board.push(move)
+                else:
+                    yield game_index, len(board.move_stack), board.copy(stack=False)
+                game_index += 1
+
+
+def init_worker(config, threads, nodes, depth):
+    global engine, info_handler, search_budget
+    cfg = config["engine"]
+    engine_path = os.path.join(cfg["dir"], cfg["name"])
+    options = parse_configs(dict(cfg.get("uci_options", {})), "classical")
+    options.pop("go_commands", None)
+    if threads is not None:
+        options["Threads"] = threads
+
+    engine = popen_uci_engine(engine_path)
+    engine.uci()
+    engine.setoption(options)
+    info_handler = chess.uci.InfoHandler()
+    engine.info_handlers.append(info_handler)
+    search_budget = {"nodes": nodes, "depth": depth}
+
+
+def analyse_position(item):
+    game_index, ply, board = item
+    if board.is_game_over():
+        return game_index, ply, board.turn, -MATE_CLIP if board.is_checkmate() else 0, 0, 0, NO_MOVE
+
+    engine.setoption({"UCI_Variant": type(board).uci_variant, "UCI_Chess960": board.chess960})
+    engine.ucinewgame()
+    engine.position(board)
+    best_move, _ = engine.go(nodes=search_budget["nodes"], depth=search_budget["depth"])
+
+    info = engine.read_info()
+    try:
+        score = info["score"][1]
+        score = score.cp if score.cp is not None else MATE_SCORE * score.mate
+    except (KeyError, AttributeError):
+        score = 0
+    return game_index, ply, board.turn, max(-MATE_CLIP, min(MATE_CLIP, score)), info.get("depth", 0), \
+        info.get("nodes", 0), encode_move(best_move)
+
+
+def analyse(config, pgn_paths, workers=None, threads=1, nodes=None, depth=None, max_plies=None):
+    """Analyses every position in the PGN files and returns a dict of NumPy arrays, one entry per position.
+
+    Scores are in centipawns from the point of view of the side to move."""
+    if nodes is None and depth is None:
+        raise ValueError("A node or depth budget is required for batch analysis.")
+
+    workers = workers or multiprocessing.cpu_count()
+    columns = ([], [], [], [], [], [], [])
+    start_time = time.time()
+    with multiprocessing.Pool(workers, initializer=init_worker, initargs=(config, threads, nodes, depth)) as pool:
+        for result in pool.imap(analyse_position, iter_positions(pgn_paths, max_plies), chunksize=8):
+            for column, value in zip(columns, result):
+                column.append(value)
+
+    results = {
+        "game": np.array(columns[0], dtype=np.int32),
+        "ply": np.array(columns[1], dtype=np.int32),
+        "white_to_move": np.array(columns[2], dtype=bool),
+        "score": np.array(columns[3], dtype=np.int32),
+        "depth": np.array(columns[4], dtype=np.int16),
+        "nodes": np.array(columns[5], dtype=np.int64),
+        "best_move": np.array(columns[6], dtype=np.int32),
+    }
+    logger.info("Analysed {} positions in {:.1f} seconds with {} workers".format(
+        len(results["score"]), time.time() - start_time, workers))
+    return results
+
+
+def centipawn_loss(results):
+    """The centipawn loss of every move, i.e. how much the evaluation of the mover dropped after playing it.
+
+    Returns an array aligned with the position *before* each move. The last position of every game has no move and
+    gets a loss of 0."""
+    score = results["score"].astype(np.int64)
+    same_game = results["game"][1:] == results["game"][:-1]
+    loss = np.zeros_like(score)
+    # the score after the move is from the opponent's point of view, hence the sum.
+    loss[:-1] = np.where(same_game, np.maximum(0, score[:-1] + score[1:]), 0)
+    return loss
+
+
+def blunders(results, threshold=200):
+    """Indices of the positions in which the move played lost at least `threshold` centipawns."""
+    return np.flatnonzero(centipawn_loss(results) >= threshold)
+
+
+def white_scores(results):
+    """Scores from white's point of view, for evaluation distributions."""
+    return np.where(results["white_to_move"], results["score"], -results["score"])
+
+
+def summary(results, blunder_threshold=200):
+    loss = centipawn_loss(results)
+    moves = np.zeros_like(loss, dtype=bool)
+    moves[:-1] = results["game"][1:] == results["game"][:-1]
+    evaluations = white_scores(results)
+    return {
+        "positions": len(results["score"]),
+        "games": len(np.unique(results["game"])),
+        "average centipawn loss": float(loss[moves].mean()) if moves.any() else 0.0,
+        "blunders": int(np.count_nonzero(loss[moves] >= blunder_threshold)),
+        "average depth": float(results["depth"].mean()) if len(results["depth"]) else 0.0,
+        "eval percentiles (5/25/50/75/95)": np.percentile(evaluations, [5, 25, 50, 75, 95]).tolist()
+        if len(evaluations) else [],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Analyse PGN files with the configured engine')
+    parser.add_argument('pgn', nargs='+', help='PGN files to analyse.')
+    parser.add_argument('--config', help='Specify a configuration file (defaults to ./config.yml)')
+    parser.add_argument('--workers', type=int, help='Number of engine processes (defaults to the number of cores).')
+    parser.add_argument('--threads', type=int, default=1, help='Engine threads per worker.')
+    parser.add_argument('--nodes', type=int, help='Node budget per position.')
+    parser.add_argument('--depth', type=int, help='Depth budget per position.')
+    parser.add_argument('--max-plies', type=int, help='Only analyse the first plies of every game.')
+    parser.add_argument('--blunder', type=int, default=200, help='Centipawn loss that counts as a blunder.')
+    parser.add_argument('-o', '--output', help='Save the result arrays to this .npz file.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)-15s: %(message)s")
+    CONFIG = load_config(args.config or "./config.yml")
+    RESULTS = analyse(CONFIG, args.pgn, args.workers, args.threads, args.nodes, args.depth, args.max_plies)
+    if args.output:
+        np.savez_compressed(args.output, **RESULTS)
+    for name, value in summary(RESULTS, args.blunder).items():
+        print("{}: {}".format(name, value))
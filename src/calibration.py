@@ -0,0 +1,103 @@
+"""
+Measures the speed of the configured engine for the node budget mode (`engine.node_budget`).
+
+The engine searches a set of reference positions for `--movetime` milliseconds each with every combination of the
+given Threads and Hash values (the other uci_options are kept), and the nodes per second of every combination are
+saved to the calibration file. The bot turns the clock into a node budget with the NPS measured with its Threads and
+Hash, so a move gets about the same search whatever the hardware, and the search can stop early when the best move
+is stable. Calibrate again after changing the engine or the machine.
+
+usage: python -m src.calibration [--threads 1 2 4] [--hash 64 256] [--movetime 2000] [-o calibration.json]
+"""
+
+import argparse
+import json
+import logging
+import os
+
+import chess
+import chess.uci
+
+from src.config import load_config
+from src.engine_wrapper import CALIBRATION_FILE, GAME_SPEEDS, get_config, popen_uci_engine
+
+logger = logging.getLogger(__name__)
+
+# openings, middlegames and endgames, so the NPS is an average over the phases of a game.
+REFERENCE_POSITIONS = (
+    chess.STARTING_FEN,
+    "r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3",
+    "r1bq1rk1/pp2bppp/2n1pn2/3p4/2PP4/2N1PN2/PP2BPPP/R2QKB1R w KQ - 0 8",
+    "r2q1rk1/1b2bppp/p2ppn2/1p6/3NP3/1BN1B3/PPP1QPPP/R4RK1 w - - 0 12",
+    "2r2rk1/pp1bqppp/2n1p3/3pP3/3P4/P1PB1N2/5PPP/R2QR1K1 b - - 2 16",
+    "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+    "8/5pk1/6p1/3R4/7P/6P1/r4PK1/8 w - - 0 40",
+    "8/8/3k4/8/2PK4/8/8/8 w - - 0 60",
+)
+
+
+def measure(engine, threads, hash_size, movetime):
+    engine.setoption({"Threads": threads, "Hash": hash_size})
+    nodes = 0
+    milliseconds = 0
+    for fen in REFERENCE_POSITIONS:
+        engine.ucinewgame()
+        engine.position(chess.Board(fen))
+        engine.go(movetime=movetime)
+        info = engine.read_info()
+        nodes += info.get("nodes", 0)
+        # engines report the time they searched, which doesn't include starting and stopping the search.
+        milliseconds += info.get("time", movetime)
+    return int(1000 * nodes / max(milliseconds, 1))
+
+
+def calibrate(config, threads, hashes, movetime):
+    cfg = config["engine"]
+    engine_path = os.path.join(cfg["dir"], cfg["name"])
+    options = {name: value for name, value in cfg.get("uci_options", {}).items()
+               if name not in ("go_commands", "Threads", "Hash")}
+
+    engine = popen_uci_engine(engine_path, cfg.get("silence_stderr", False))
+    engine.uci()
+    if options:
+        engine.setoption({name: get_config(value, "blitz") if type(value) == dict else value
+                          for name, value in options.items()})
+    info_handler = chess.uci.InfoHandler()
+    engine.info_handlers.append(info_handler)
+
+    results = []
+    try:
+        for thread_count in threads:
+            for hash_size in hashes:
+                nps = measure(engine, thread_count, hash_size, movetime)
+                logger.info("Threads {:>3}, Hash {:>6}: {} nps".format(thread_count, hash_size, nps))
+                results.append({"Threads": thread_count, "Hash": hash_size, "nps": nps})
+    finally:
+        engine.quit()
+    return {"engine": engine.name, "movetime": movetime, "results": results}
+
+
+def configured_hashes(config):
+    """The Hash values of uci_options, one per speed when it's a dict per speed."""
+    hash_size = config["engine"].get("uci_options", {}).get("Hash", 16)
+    if type(hash_size) == dict:
+        return sorted({get_config(hash_size, speed) for speed in GAME_SPEEDS} - {None})
+    return [hash_size]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Measure the NPS of the configured engine for the node budget mode')
+    parser.add_argument('--config', help='Specify a configuration file (defaults to ./config.yml)')
+    parser.add_argument('--threads', type=int, nargs='+', help='Threads to measure (defaults to uci_options).')
+    parser.add_argument('--hash', type=int, nargs='+', help='Hash sizes to measure (defaults to uci_options).')
+    parser.add_argument('--movetime', type=int, default=2000, help='Milliseconds searched per reference position.')
+    parser.add_argument('-o', '--output', default=CALIBRATION_FILE, help='Calibration file to write.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)-15s: %(message)s")
+    CONFIG = load_config(args.config or "./config.yml")
+    THREADS = args.threads or [CONFIG["engine"].get("uci_options", {}).get("Threads", 1)]
+    CALIBRATION = calibrate(CONFIG, THREADS, args.hash or configured_hashes(CONFIG), args.movetime)
+    with open(args.output, "w") as calibration_file:
+        json.dump(CALIBRATION, calibration_file, indent=2)
+    print("Saved the calibration of {} to {}".format(CALIBRATION["engine"], args.output))
@@ -39,12 +39,20 @@ def load_config(config_file):
         if not os.path.isdir(config["engine"]["dir"]):
             raise Exception("Your engine directory `{}` is not a directory.")
 
-        engine = os.path.join(config["engine"]["dir"], config["engine"]["name"])
+        engines = [config["engine"]]
+        for route in config["engine"].get("routes", []):
+            if not isinstance(route.get("engine"), dict):
+                raise Exception("Every engine route must have an `engine` dictionary.")
+            engines.append(dict(config["engine"], **route["engine"]))
 
-        if not os.path.isfile(engine):
-            raise Exception("The engine %s file does not exist." % engine)
+        for engine_cfg in engines:
+            engine = os.path.join(engine_cfg["dir"], engine_cfg["name"])
 
-        if not os.access(engine, os.X_OK):
-            raise Exception("The engine %s doesn't have execute (x) permission. Try: chmod +x %s" % (engine, engine))
+            if not os.path.isfile(engine):
+                raise Exception("The engine %s file does not exist." % engine)
+
+            if not os.access(engine, os.X_OK):
+                raise Exception("The engine %s doesn't have execute (x) permission. Try: chmod +x %s" %
+                                (engine, engine))
 
     return config
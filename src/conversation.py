@@ -1,10 +1,29 @@
+import collections
+import logging
+import os
+import threading
+import time
+
+from src import profiler
+
+logger = logging.getLogger(__name__)
+
+# replies to a chat room are sent at most once every `ROOM_INTERVAL` seconds, and a reply identical to one sent to the
+# same room in the last `DEDUP_SECONDS` is dropped. Lichess cuts chat messages at `MAX_LENGTH` characters.
+ROOM_INTERVAL = 1
+DEDUP_SECONDS = 10
+MAX_LENGTH = 140
+
+sender = None
+
+
 class Conversation:
     command_prefix = "!"
     username_prefix = "@"
     spectator_prefix = "spectator<"
-    built_in_commands = ["name", "howto", "eval", "queue", "chat"]
+    built_in_commands = ["name", "howto", "eval", "queue", "chat", "profile"]
 
-    def __init__(self, game, engine, xhr, version, challenge_queue, commands, username):
+    def __init__(self, game, engine, xhr, version, challenge_queue, commands, username, profiler_owner=None):
         self.game = game
         self.engine = engine
         self.xhr = xhr
@@ -12,6 +31,7 @@ class Conversation:
         self.challengers = challenge_queue
         self._commands = commands
         self.username = username
+        self.profiler_owner = profiler_owner
 
         self._commands = {k.lower(): v for k, v in self._commands.items()}
         self._commands_string = Conversation.command_prefix + ", {}".format(Conversation.command_prefix).join(
@@ -52,7 +72,7 @@ class Conversation:
             self.send_reply(line, "How to run your own bot: lichess.org/api#tag/Chess-Bot")
         elif cmd == "eval":
             if line.room == "spectator" or line.username.lower() == self.username.lower():
-                stats = self.engine.get_stats()
+                stats = self.engine.last_stats
                 if len(stats) == 0:
                     self.send_reply(line, "No evaluation reported.")
                 else:
@@ -60,11 +80,20 @@ class Conversation:
             else:
                 self.send_reply(line, "I don't tell that to my opponent, sorry.")
         elif cmd == "queue":
-            if self.challengers:
-                challengers = ", ".join(["@" + challenger.challenger_name for challenger in reversed(self.challengers)])
+            # one copy of the shared queue, instead of a round trip to the manager for every challenge.
+            challengers = self.challengers[:]
+            if challengers:
+                challengers = ", ".join(["@" + challenger.challenger_name for challenger in reversed(challengers)])
                 self.send_reply(line, "Challenge queue: {}".format(challengers))
             else:
                 self.send_reply(line, "No challenges queued.")
+        elif cmd == "profile" and self.profiler_owner and line.username.lower() == self.profiler_owner.lower():
+            if profiler.profiler is None:
+                self.send_reply(line, "Profiling is disabled.")
+            elif profiler.toggle() is None:
+                self.send_reply(line, "Profiling started.")
+            else:
+                self.send_reply(line, "Profile written.")
         elif cmd == "chat":
             self.send_reply(line, "You can chat with me (if I'm watching) by prepending messages with \"@{} \".".format(
                 self.username
@@ -79,7 +108,82 @@ class Conversation:
         self.send_reply(line, text)
 
     def send_reply(self, line, reply):
-        self.xhr.chat(self.game.id, line.room, reply)
+        chat_sender().send(self.xhr, self.game.id, line.room, reply)
+
+
+def chat_sender():
+    """The chat sender of this process, started on first use (pool workers don't inherit the thread)."""
+    global sender
+    if sender is None or sender.pid != os.getpid():
+        sender = ChatSender()
+    return sender
+
+
+class ChatSender:
+    """Sends the chat replies of every game of the process on a background thread, so answering the chat never delays
+    reading the game stream.
+
+    Every room gets at most a message every `interval` seconds. Replies waiting for their room are joined into one
+    message while they fit, and a reply identical to one waiting or recently sent to the room is dropped."""
+
+    def __init__(self, interval=ROOM_INTERVAL, dedup_seconds=DEDUP_SECONDS):
+        self.interval = interval
+        self.dedup_seconds = dedup_seconds
+        self.pid = os.getpid()
+        self.condition = threading.Condition()
+        # (game id, room) -> (xhr, waiting replies), in the order the rooms got their first waiting reply.
+        self.waiting = collections.OrderedDict()
+        self.next_send = {}
+        # (game id, room, text) -> time sent
+        self.sent = {}
+        self.dropped = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def send(self, xhr, game_id, room, text):
+        with self.condition:
+            key = (game_id, room)
+            replies = self.waiting.setdefault(key, (xhr, []))[1]
+            if text in replies or time.time() - self.sent.get((game_id, room, text), 0) < self.dedup_seconds:
+                self.dropped += 1
+                logger.debug("Dropped a repeated reply to {} {}: {}".format(game_id, room, text))
+                if not replies:
+                    del self.waiting[key]
+                return
+            replies.append(text)
+            self.condition.notify()
+
+    def _next_message(self):
+        with self.condition:
+            while True:
+                now = time.time()
+                key = next((key for key in self.waiting if self.next_send.get(key, 0) <= now), None)
+                if key is not None:
+                    break
+                due = [self.next_send[key] for key in self.waiting]
+                self.condition.wait(min(due) - now if due else None)
+
+            xhr, replies = self.waiting.pop(key)
+            count = 1
+            while count < len(replies) and len(" ".join(replies[:count + 1])) <= MAX_LENGTH:
+                count += 1
+            if count < len(replies):
+                self.waiting[key] = (xhr, replies[count:])
+            self.next_send[key] = now + self.interval
+            for text in replies[:count]:
+                self.sent[key + (text,)] = now
+            # forget the rooms and replies that can't limit anything anymore.
+            self.next_send = {room: at for room, at in self.next_send.items() if at > now}
+            self.sent = {reply: at for reply, at in self.sent.items() if now - at < self.dedup_seconds}
+            return xhr, key, " ".join(replies[:count])
+
+    def _run(self):
+        while True:
+            xhr, (game_id, room), text = self._next_message()
+            try:
+                xhr.chat(game_id, room, text)
+            except Exception:
+                logger.warning("Failed to send a chat message to {}".format(game_id), exc_info=True)
 
 
 class ChatLine:
@@ -0,0 +1,194 @@
+"""
+Correspondence games without a game stream or engine per game.
+
+Every correspondence game is saved to disk and only woken when the opponent has moved, which is detected by polling
+the ongoing games. A few engines are shared round-robin by all the games and search every move with a fixed budget.
+"""
+
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from requests.exceptions import HTTPError
+
+from src import model
+
+logger = logging.getLogger(__name__)
+
+terminated = False
+
+
+def game_files(directory):
+    return glob.glob(os.path.join(directory, "*.json"))
+
+
+def count_games(directory):
+    return len(game_files(directory))
+
+
+def is_saved(directory, game_id):
+    return os.path.exists(os.path.join(directory, "{}.json".format(game_id)))
+
+
+class CorrespondenceScheduler:
+    def __init__(self, li, username, engine_factory, board_factory, config):
+        self.li = li
+        self.username = username
+        self.engine_factory = engine_factory
+        self.board_factory = board_factory
+        self.directory = config.get("dir", "./correspondence")
+        self.engine_count = config.get("engines", 1)
+        self.nodes = config.get("nodes", 1000000)
+        self.movetime = config.get("movetime", 30000)
+        self.poll_interval = config.get("poll_interval", 60)
+
+        self.games = {}
+        self.boards = {}
+        self.engines = []
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+        os.makedirs(self.directory, exist_ok=True)
+        for path in game_files(self.directory):
+            with open(path) as game_file:
+                game_json = json.load(game_file)
+            self.games[game_json["id"]] = game_json
+
+    def run(self):
+        logger.info("Correspondence scheduler started with {} saved games".format(len(self.games)))
+        with ThreadPoolExecutor(self.engine_count) as executor:
+            while not terminated:
+                # nothing restarts the scheduler, so a failed poll or game is logged and retried on the next poll.
+                try:
+                    due_games = self.poll()
+                except Exception as exception:
+                    logger.error("Correspondence poll failed: {}".format(exception))
+                    due_games = []
+                # the executor threads each own their engines, so the games are time-sliced round-robin between them.
+                for _ in executor.map(self.play_guarded, due_games):
+                    pass
+                time.sleep(self.poll_interval)
+        for engine in self.engines:
+            engine.quit()
+
+    def poll(self):
+        ongoing_games = {g["gameId"]: g for g in self.li.get_ongoing_games() if g.get("speed") == "correspondence"}
+
+        for game_id in list(self.games):
+            if game_id not in ongoing_games:
+                logger.info("--- Correspondence game {} is over".format(game_id))
+                self.forget(game_id)
+
+        due_games = []
+        for game_id, info in ongoing_games.items():
+            if game_id not in self.games:
+                self.fetch(game_id)
+            if info.get("isMyTurn"):
+                due_games.append((game_id, info))
+        return due_games
+
+    def fetch(self, game_id):
+        # open the game stream only to read the full game, then close it right away.
+        response = self.li.get_game_stream(game_id)
+        try:
+            game_json = json.loads(next(response.iter_lines()).decode('utf-8'))
+        finally:
+            response.close()
+        self.games[game_id] = game_json
+        self.boards.pop(game_id, None)
+        self.save(game_id)
+        return game_json
+
+    def board(self, game_id, info):
+        """The current board of the game, updated with the opponent's last move without reading the game stream."""
+        board = self.boards.get(game_id)
+        if board is None:
+            board = self.board_factory(self.game(game_id))
+        elif info.get("lastMove") and board.board_fen() != info.get("fen", "").split(" ")[0]:
+            try:
+                board.push_uci(info["lastMove"])
+            except ValueError:
+                pass
+
+        if board.board_fen() != info.get("fen", board.board_fen()).split(" ")[0]:
+            self.fetch(game_id)
+            board = self.board_factory(self.game(game_id))
+        self.boards[game_id] = board
+        return board
+
+    def game(self, game_id):
+        return model.Game(self.games[game_id], self.username, self.li.baseUrl, 0)
+
+    def engine(self, board):
+        engines = getattr(self.local, "engines", None)
+        if engines is None:
+            engines = self.local.engines = {}
+        key = (type(board).uci_variant, board.chess960)
+        if key not in engines:
+            engines[key] = self.engine_factory(board, "correspondence", type(board).uci_variant)
+            with self.lock:
+                self.engines.append(engines[key])
+        return engines[key]
+
+    def drop_engine(self, board):
+        engine = self.local.engines.pop((type(board).uci_variant, board.chess960), None)
+        if engine is not None:
+            with self.lock:
+                self.engines.remove(engine)
+            try:
+                engine.quit()
+            except Exception:
+                pass  # already dead
+
+    def play_guarded(self, due_game):
+        game_id, _ = due_game
+        try:
+            self.play(due_game)
+        except Exception:
+            logger.exception("Could not play in correspondence game {}".format(game_id))
+            self.boards.pop(game_id, None)
+
+    def play(self, due_game):
+        game_id, info = due_game
+        board = self.board(game_id, info)
+        if board.is_game_over():
+            return
+        engine = self.engine(board)
+        try:
+            move = engine.fixed_search(board, nodes=self.nodes, movetime=self.movetime)
+        except Exception:
+            # a crashed engine is replaced by the next game that needs it.
+            self.drop_engine(board)
+            raise
+        try:
+            self.li.make_move(game_id, move)
+        except HTTPError as exception:
+            logger.error("Could not play {} in correspondence game {}: {}".format(move, game_id, exception))
+            self.boards.pop(game_id, None)
+            return
+        board.push(move)
+        self.games[game_id]["state"]["moves"] = " ".join(m.uci() for m in board.move_stack)
+        self.save(game_id)
+        logger.info("    Played {} in correspondence game {}".format(move, game_id))
+
+    def save(self, game_id):
+        path = os.path.join(self.directory, "{}.json".format(game_id))
+        with open(path + ".tmp", "w") as game_file:
+            json.dump(self.games[game_id], game_file)
+        os.replace(path + ".tmp", path)
+
+    def forget(self, game_id):
+        del self.games[game_id]
+        self.boards.pop(game_id, None)
+        try:
+            os.remove(os.path.join(self.directory, "{}.json".format(game_id)))
+        except FileNotFoundError:
+            pass
+
+
+def run_scheduler(li, username, engine_factory, board_factory, config):
+    CorrespondenceScheduler(li, username, engine_factory, board_factory, config).run()
@@ -1,13 +1,22 @@
+import collections
+import concurrent.futures
 import copy
+import json
+import logging
 import os
+import queue
 import subprocess
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import backoff
 import chess
+import chess.polyglot
 import chess.uci
 import chess.xboard
 
+logger = logging.getLogger(__name__)
 
 MATE_SCORE = 1 << 31
 
@@ -17,6 +26,22 @@ MATE_SCORE = 1 << 31
 # connection that lags every once in a while.
 XBOARD_MOVE_OVERHEAD = 1000
 
+# a search is checked on every `heartbeat_interval` seconds and the engine is restarted if it has died or doesn't
+# answer the heartbeat within `heartbeat_timeout` seconds.
+HEARTBEAT_INTERVAL = 1
+HEARTBEAT_TIMEOUT = 5
+MAX_RESTARTS = 2
+
+ENGINE_FAILURES = (chess.uci.EngineTerminatedException, concurrent.futures.TimeoutError)
+
+# in the node budget mode (`node_budget`) a move gets the nodes the engine searches in 1/`moves_to_go` of the clock,
+# and the search is stopped once the best move hasn't changed for `stable_depths` depths and at least `min_share` of
+# the budget has been searched. the speed of the engine is measured with `python -m src.calibration`.
+CALIBRATION_FILE = "calibration.json"
+MOVES_TO_GO = 30
+STABLE_DEPTHS = 4
+MIN_BUDGET_SHARE = 0.3
+
 METRIC_PREFIXES = {
     10 ** 12: "T",
     10 ** 9: "G",
@@ -32,18 +57,12 @@ LARGE_NUMBER_ABBREVIATIONS = {
 }
 
 
-GAME_SPEEDS = ("ultraBullet", "bullet", "blitz", "rapid", "classical")
+# the speeds where the nodes of a speculative search are about what the clock allows a move.
+SPECULATION_SPEEDS = ("ultraBullet", "bullet", "blitz")
+GAME_SPEEDS = ("ultraBullet", "bullet", "blitz", "rapid", "classical", "correspondence")
 
-PIECES = frozenset((
-    chess.Piece(chess.KNIGHT, chess.WHITE),
-    chess.Piece(chess.KNIGHT, chess.BLACK),
-    chess.Piece(chess.BISHOP, chess.WHITE),
-    chess.Piece(chess.BISHOP, chess.BLACK),
-    chess.Piece(chess.ROOK, chess.WHITE),
-    chess.Piece(chess.ROOK, chess.BLACK),
-    chess.Piece(chess.QUEEN, chess.WHITE),
-    chess.Piece(chess.QUEEN, chess.BLACK),
-))
+DRAW_CONDITIONS = {"threshold": -1, "sustain_turns": 9999, "minimum_turns": 0, "endgame_only": True}
+RESIGNATION_CONDITIONS = {"threshold": 9999 * MATE_SCORE, "sustain_turns": 1, "endgame_only": True}
 
 
 def get_config(config, speed):
@@ -71,9 +90,33 @@ def parse_configs(options, speed):
     return options
 
 
+def parse_game_end_conditions(conditions, defaults, speed):
+    # every condition can be a single value or a dict of values per speed (like `Hash`), which is what
+    # `python -m src.tuning` outputs.
+    parsed = dict(defaults)
+    parsed.update(parse_configs(dict(conditions), speed))
+    return parsed
+
+
+def select_route(cfg, speed, variant=None, rating=None):
+    """Returns the name and engine config of the first route matching the game, or the default engine."""
+    for index, route in enumerate(cfg.get("routes", [])):
+        if "speeds" in route and speed not in route["speeds"]:
+            continue
+        if "variants" in route and variant not in route["variants"]:
+            continue
+        if rating is not None and not route.get("min_rating", 0) <= rating <= route.get("max_rating", 9999):
+            continue
+        route_cfg = dict(cfg)
+        del route_cfg["routes"]
+        route_cfg.update(route["engine"])
+        return route.get("name", "route {}".format(index + 1)), route_cfg
+    return "default", cfg
+
+
 @backoff.on_exception(backoff.expo, BaseException, max_time=120)
-def create_engine(config, board, game_speed):
-    cfg = config["engine"]
+def create_engine(config, board, game_speed, variant=None, rating=None):
+    route, cfg = select_route(config["engine"], game_speed, variant, rating)
     engine_path = os.path.join(cfg["dir"], cfg["name"])
     engine_type = cfg.get("protocol")
     engine_options = cfg.get("engine_options", {})
@@ -86,21 +129,258 @@ def create_engine(config, board, game_speed):
     ponder = cfg.get("ponder", False)
 
     game_end_conditions = {
-        "draw": cfg.get("offer_draw", {"threshold": -1, "sustain_turns": 9999, "minimum_turns": 0}),
-        "resignation": cfg.get("resignation", {"threshold": 9999 * MATE_SCORE, "sustain_turns": 1}),
+        "draw": parse_game_end_conditions(cfg.get("offer_draw", {}), DRAW_CONDITIONS, game_speed),
+        "resignation": parse_game_end_conditions(cfg.get("resignation", {}), RESIGNATION_CONDITIONS, game_speed),
     }
 
     if engine_type == "xboard":
-        options = parse_configs(cfg.get("xboard_options", {}), game_speed)
-        return XBoardEngine(board, commands, options, game_end_conditions, silence_stderr)
+        options = parse_configs(dict(cfg.get("xboard_options", {})), game_speed)
+        engine = XBoardEngine(board, commands, options, game_end_conditions, silence_stderr, ponder)
     else:
-        options = parse_configs(cfg.get("uci_options", {}), game_speed)
-        return UCIEngine(board, commands, options, game_end_conditions, silence_stderr, ponder)
+        options = parse_configs(dict(cfg.get("uci_options", {})), game_speed)
+        speculation = cfg.get("speculative_ponder")
+        if speculation and game_speed not in speculation.get("speeds", SPECULATION_SPEEDS):
+            speculation = None  # a hit would play a much shorter search than the clock allows
+        engine = UCIEngine(board, commands, options, game_end_conditions, silence_stderr, ponder, speculation,
+                           cfg.get("info_lines", "latest"))
+        node_budget = cfg.get("node_budget", {})
+        if node_budget.get("enabled"):
+            nps = calibrated_nps(node_budget.get("calibration", CALIBRATION_FILE), options) or node_budget.get("nps")
+            if nps:
+                engine.node_budget = NodeBudget(nps, node_budget)
+            else:
+                logger.warning("No calibrated NPS for Threads={} and Hash={}, searching on the clock instead".format(
+                    options.get("Threads", 1), options.get("Hash", 16)))
+    engine.route = route
+    supervision = cfg.get("supervision", {})
+    engine.heartbeat_interval = supervision.get("heartbeat_interval", HEARTBEAT_INTERVAL)
+    engine.heartbeat_timeout = supervision.get("heartbeat_timeout", HEARTBEAT_TIMEOUT)
+    engine.max_restarts = supervision.get("max_restarts", MAX_RESTARTS)
+    return engine
+
+
+class LeanEngine(chess.uci.Engine):
+    """A UCI engine that keeps the text of the latest info line of every pv and only parses those when the info is
+    read, instead of parsing every line on the reader thread as it arrives. Progress lines without a score (currmove,
+    hashfull, ...) are dropped.
+
+    With `parse_all`, every line is parsed like `chess.uci.Engine` does.
+
+    Positions are sent from the last capture or pawn move instead of from the start of the game, and a position that
+    only appends moves to the last one sent extends the last command instead of formatting the moves again."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.parse_all = False
+        # stops the search once the best move is stable, see `NodeBudget`.
+        self.node_budget = None
+        self.latest_info = {}
+        # `latest_info` is written on the reader thread and swapped out on the game thread.
+        self.info_lock = threading.Lock()
+        self.info_lines = 0
+        self.parsed_lines = 0
+        # the last position sent: its root ply in the game, the board from the root and the command.
+        self.sent_ply = None
+        self.sent_board = None
+        self.sent_command = None
+        self.extended_positions = 0
+
+    def position(self, board, *, async_callback=None):
+        with self.state_changed:
+            if not self.idle:
+                raise chess.uci.EngineStateException("position command while engine is busy")
+
+        options = {}
+        if type(board).uci_variant != (self.uci_variant or "chess"):
+            options["UCI_Variant"] = type(board).uci_variant
+        if bool(self.uci_chess960) != board.chess960:
+            options["UCI_Chess960"] = board.chess960
+        option_lines = self._setoption(options)
+        command = self.position_command(board)
+        self.board = board.copy(stack=False)
+
+        def send():
+            with self.semaphore:
+                for option_line in option_lines:
+                    self.send_line(option_line)
+                self.send_line(command)
+                if self.terminated.is_set():
+                    raise chess.uci.EngineTerminatedException()
+
+        return self._queue_command(send, async_callback)
+
+    def position_command(self, board):
+        # the positions before the last capture or pawn move can't come back, the moves before it don't matter for
+        # repetitions.
+        window = min(board.halfmove_clock, len(board.move_stack))
+        root_ply = len(board.move_stack) - window
+        sent = self.sent_board
+        if sent is not None and root_ply == self.sent_ply and type(board) == type(sent) \
+                and board.chess960 == sent.chess960:
+            sent_moves = len(sent.move_stack)
+            appended = board.move_stack[root_ply + sent_moves:]
+            if len(appended) == window - sent_moves \
+                    and (sent_moves == 0 or board.move_stack[root_ply + sent_moves - 1] == sent.peek()):
+                for move in appended:
+                    sent.push(move)
+                if sent.fen() == board.fen():
+                    self.extended_positions += 1
+                    if appended:
+                        self.sent_command += (" " if sent_moves else " moves ") + " ".join(
+                            move.uci() for move in appended)
+                    return self.sent_command
+
+        root = board.copy(stack=window)
+        for _ in range(window):
+            root.pop()
+        fen = root.fen()
+        if type(board).uci_variant == "chess" and fen == chess.STARTING_FEN:
+            command = "position startpos"
+        else:
+            command = "position fen " + (root.shredder_fen() if self.uci_chess960 else fen)
+        if window:
+            command += " moves " + " ".join(move.uci() for move in board.move_stack[root_ply:])
+        self.sent_ply = root_ply
+        self.sent_board = board.copy(stack=window)
+        self.sent_command = command
+        return command
+
+    def go(self, **kwargs):
+        with self.info_lock:
+            self.latest_info = {}
+        return super().go(**kwargs)
+
+    def _info(self, arg):
+        self.info_lines += 1
+        if self.node_budget is not None and self.node_budget.should_stop(arg):
+            self.stop(async_callback=True)
+        if self.parse_all:
+            self.parsed_lines += 1
+            return super()._info(arg)
+        if arg.startswith("string "):
+            with self.info_lock:
+                self.latest_info["string"] = arg
+        elif " score " in arg or arg.startswith("score "):
+            # the multipv number is the only field needed right away.
+            index = arg.find("multipv ")
+            key = arg[index + 8:].split(None, 1)[0] if index >= 0 else "1"
+            with self.info_lock:
+                self.latest_info[key] = arg
+
+    def read_info(self):
+        """The info of the current or last search, like `InfoHandler.info`."""
+        with self.info_lock:
+            lines, self.latest_info = self.latest_info, {}
+        for line in lines.values():
+            super()._info(line)
+        self.parsed_lines += len(lines)
+        return self.info_handlers[0].info
+
+
+def popen_uci_engine(commands, silence_stderr=False, info_lines="latest"):
+    engine = chess.uci.popen_engine(commands, engine_cls=LeanEngine,
+                                    stderr=subprocess.DEVNULL if silence_stderr else None)
+    engine.parse_all = info_lines == "all"
+    return engine
+
+
+def calibrated_nps(path, options):
+    """The NPS measured by `python -m src.calibration` with the Threads and Hash of `options`, or None. Without a
+    measurement of the same Hash, the closest one with the same Threads is used."""
+    try:
+        with open(path) as calibration_file:
+            calibration = json.load(calibration_file)
+    except (OSError, ValueError):
+        return None
+    threads = options.get("Threads", 1)
+    hash_size = options.get("Hash", 16)
+    results = [result for result in calibration["results"] if result["Threads"] == threads]
+    if not results:
+        return None
+    return min(results, key=lambda result: abs(result["Hash"] - hash_size))["nps"]
+
+
+class NodeBudget:
+    """Turns the clock into a node budget at the calibrated speed of the engine and tells when a search can stop
+    before the budget is spent because more depth doesn't change the best move."""
+
+    def __init__(self, nps, config):
+        self.nps = nps
+        self.moves_to_go = config.get("moves_to_go", MOVES_TO_GO)
+        self.stable_depths = config.get("stable_depths", STABLE_DEPTHS)
+        self.min_share = config.get("min_share", MIN_BUDGET_SHARE)
+
+        self.nodes = 0
+        self.best_move = None
+        self.best_move_depth = 0
+        self.stopping = False
+
+        self.searches = 0
+        self.early_stops = 0
+        self.budgeted_nodes = 0
+        self.searched_nodes = 0
+
+    def allot(self, time_left, increment):
+        """Starts a search. Returns its node budget and a hard time limit in milliseconds, in case the engine is
+        slower than calibrated (e.g. on a busy host)."""
+        movetime = min(time_left / self.moves_to_go + increment, time_left / 4)
+        self.nodes = max(1, int(self.nps * movetime / 1000))
+        self.best_move = None
+        self.best_move_depth = 0
+        self.stopping = False
+        self.searches += 1
+        self.budgeted_nodes += self.nodes
+        return self.nodes, max(1, int(min(2 * movetime, time_left / 3)))
+
+    def should_stop(self, line):
+        """Called with every info line of the search, true (once) when the search should be stopped."""
+        if self.stopping or " pv " not in line:
+            return False
+        tokens = line.split()
+        if "lowerbound" in tokens or "upperbound" in tokens:
+            return False
+        try:
+            if "multipv" in tokens and tokens[tokens.index("multipv") + 1] != "1":
+                return False
+            depth = int(tokens[tokens.index("depth") + 1])
+            nodes = int(tokens[tokens.index("nodes") + 1]) if "nodes" in tokens else 0
+            move = tokens[tokens.index("pv") + 1]
+        except (ValueError, IndexError):
+            return False
+        if move != self.best_move:
+            self.best_move = move
+            self.best_move_depth = depth
+        if depth - self.best_move_depth >= self.stable_depths and nodes >= self.min_share * self.nodes:
+            self.stopping = True
+            self.early_stops += 1
+            return True
+        return False
+
+    def get_stats(self):
+        return {"searches": self.searches, "early_stops": self.early_stops,
+                "budget_used": self.searched_nodes / self.budgeted_nodes if self.budgeted_nodes else 0}
+
+
+def draw_allowed(conditions, fullmove_number, halfmove_clock, endgame):
+    """Whether the draw conditions allow an offer in the position at all, whatever the scores. Takes plain values or
+    NumPy arrays, so `python -m src.tuning` applies the same rule to the recorded games."""
+    return (fullmove_number >= conditions["minimum_turns"]) & (halfmove_clock >= 2 * conditions["sustain_turns"]) & \
+        (endgame | (not conditions["endgame_only"]))
 
 
 def is_endgame(board):
-    pieces = tuple(p for p in board.piece_map().values() if p in PIECES)
-    return len(pieces) <= 6
+    # the piece bitboards are kept up to date by every push, so counting the minor and major pieces is a popcount.
+    return chess.popcount(board.knights | board.bishops | board.rooks | board.queens) <= 6
+
+
+def abbreviate(value, abbreviations, separator=""):
+    for size, abbreviation in abbreviations.items():
+        if value >= size:
+            formatted_value = round(value / size, 1)
+            if round(formatted_value) >= 10:
+                formatted_value = round(formatted_value)
+            return "{}{}{}".format(formatted_value, separator, abbreviation)
+    return "{}{}".format(value, separator)
 
 
 class EngineWrapper:
@@ -114,11 +394,36 @@ class EngineWrapper:
         self.silence_stderr = silence_stderr
         self.ponder_on = ponder_on
 
-        self.past_scores = []
+        self.route = "default"
+        self.searches = 0
+        self.search_time = 0
+        self.nodes = 0
+
+        self.heartbeat_interval = HEARTBEAT_INTERVAL
+        self.heartbeat_timeout = HEARTBEAT_TIMEOUT
+        self.max_restarts = MAX_RESTARTS
+        # seconds from detecting a dead or hung engine until its replacement is ready, per restart.
+        self.recoveries = []
+        # searches that started while the engine pondered, and those where it pondered on the opponent's move.
+        self.ponder_searches = 0
+        self.ponder_hits = 0
+
+        # only the last `sustain_turns` scores are needed for the draw and resignation conditions.
+        self.past_scores = collections.deque(maxlen=max(self.draw_conditions["sustain_turns"],
+                                                        self.resignation_conditions["sustain_turns"]))
+        # [fullmove number, score, search seconds, is endgame, halfmove clock] for every search, kept for `src.tuning`.
+        self.score_history = []
         self.is_game_over = False
+        # the stats of the last search, read by `!eval` from the thread of the game stream.
+        self.last_stats = []
+        # depth and nps of the last search, for the status table.
+        self.last_search = {}
 
         self.did_first_move = False
 
+    def start_engine(self, board, timeout=None):
+        pass
+
     def set_time_control(self, game):
         pass
 
@@ -128,48 +433,133 @@ class EngineWrapper:
     def search(self, board, wtime, btime, winc, binc):
         pass
 
+    def fixed_search(self, board, nodes=None, movetime=None):
+        pass
+
     def print_stats(self):
         pass
 
     def name(self):
         return self.engine.name
 
+    def stop(self):
+        try:
+            self.engine.stop(async_callback=True)
+        except chess.uci.EngineTerminatedException:
+            pass  # the search that is waiting on it restarts the engine
+
     def quit(self):
-        self.engine.quit()
+        try:
+            self.engine.quit()
+        except chess.uci.EngineTerminatedException:
+            pass
+
+    def heartbeat(self):
+        # xboard engines may not answer ping while thinking, so only a dead process is detected by default.
+        if not self.engine.is_alive():
+            raise chess.uci.EngineTerminatedException()
+
+    def wait_for_search(self, command):
+        # a dead engine (pipe EOF) resolves the command with EngineTerminatedException, a hung one fails the heartbeat.
+        while True:
+            try:
+                return command.result(timeout=self.heartbeat_interval)
+            except concurrent.futures.TimeoutError:
+                pass
+            self.heartbeat()
+
+    def supervised_search(self, board, go):
+        """Waits for the search started by `go()`. If the engine dies or stops responding, it is replaced and `go()` is
+        called again, at most `max_restarts` times."""
+        restarts = 0
+        while True:
+            try:
+                return self.wait_for_search(go())
+            except ENGINE_FAILURES:
+                if self.is_game_over or restarts >= self.max_restarts:
+                    raise
+                restarts += 1
+                self.restart(board)
+
+    def restart(self, board):
+        """Replaces a dead or hung engine with a new one set up with the options and the position of `board`."""
+        logger.warning("Engine died or stopped responding, restarting it")
+        start = time.time()
+        try:
+            self.engine.kill()
+        except Exception:
+            pass  # already gone
+        self.start_engine(board, self.heartbeat_timeout)
+        self.recoveries.append(time.time() - start)
+        logger.warning("Restarted the engine in {:.2f}s".format(self.recoveries[-1]))
+
+    def get_speculation_stats(self):
+        return None
+
+    def get_info_line_stats(self):
+        return None
+
+    def get_node_budget_stats(self):
+        return None
+
+    def is_pondering(self):
+        return False
+
+    def get_ponder_stats(self):
+        if not self.ponder_searches:
+            return None
+        return {"hits": self.ponder_hits, "searches": self.ponder_searches,
+                "hit_rate": self.ponder_hits / self.ponder_searches}
+
+    def get_state(self):
+        """What a restarted bot needs to resume the game with this engine, see `src.snapshots`."""
+        return {"past_scores": list(self.past_scores), "score_history": self.score_history,
+                "did_first_move": self.did_first_move, "ponder_move": None}
+
+    def restore_state(self, state):
+        self.past_scores.clear()
+        self.past_scores.extend(state["past_scores"])
+        self.score_history = state["score_history"]
+        self.did_first_move = state["did_first_move"]
+
+    def resume_ponder(self, board, ponder_move, wtime, btime, winc, binc):
+        pass
+
+    def record_score(self, board, score, search_time, nodes=None):
+        self.score_history.append([board.fullmove_number, score, round(search_time, 3), is_endgame(board),
+                                   board.halfmove_clock])
+        self.searches += 1
+        self.search_time += search_time
+        self.nodes += nodes or 0
+
+    def get_route_stats(self):
+        return {"route": self.route, "searches": self.searches, "search_time": self.search_time, "nodes": self.nodes,
+                "restarts": len(self.recoveries), "recovery_time": sum(self.recoveries)}
+
+    def last_scores(self, turns):
+        return list(self.past_scores)[-turns:]
 
     def process_endgame_conditions(self, board):
-        draw_scores = self.past_scores[-self.draw_conditions["sustain_turns"]:]
-        draw = abs(max(draw_scores, key=abs)) <= self.draw_conditions["threshold"] \
-            if board.fullmove_number >= self.draw_conditions["minimum_turns"] and \
-            board.halfmove_clock >= 2 * self.draw_conditions["sustain_turns"] and \
-            len(self.past_scores) >= self.draw_conditions["sustain_turns"] and \
-            is_endgame(board) else False
-
-        resign_scores = self.past_scores[-self.resignation_conditions["sustain_turns"]:]
+        endgame = is_endgame(board)
+
+        draw = abs(max(self.last_scores(self.draw_conditions["sustain_turns"]), key=abs)) <= \
+            self.draw_conditions["threshold"] \
+            if draw_allowed(self.draw_conditions, board.fullmove_number, board.halfmove_clock, endgame) and \
+            len(self.past_scores) >= self.draw_conditions["sustain_turns"] else False
+
+        resign_scores = self.last_scores(self.resignation_conditions["sustain_turns"])
         resign = max(resign_scores) <= -self.resignation_conditions["threshold"] \
             if len(resign_scores) >= self.resignation_conditions["sustain_turns"] and \
-            is_endgame(board) else False
+            (not self.resignation_conditions["endgame_only"] or endgame) else False
 
         return draw, resign
 
     @staticmethod
     def get_pretty_stat(stat_name, stat_value):
         if stat_name == "nps":
-            for size, prefix in METRIC_PREFIXES.items():
-                if stat_value >= size:
-                    formatted_value = round(stat_value / size, 1)
-                    if round(formatted_value) >= 10:
-                        formatted_value = round(formatted_value)
-                    return "{} {}nps".format(formatted_value, prefix)
-            return "{} nps".format(stat_value)
+            return "{}nps".format(abbreviate(stat_value, METRIC_PREFIXES, " "))
         elif stat_name == "nodes":
-            for size, abbreviation in LARGE_NUMBER_ABBREVIATIONS.items():
-                if stat_value >= size:
-                    formatted_value = round(stat_value / size, 1)
-                    if round(formatted_value) >= 10:
-                        formatted_value = round(formatted_value)
-                    return "{}{} nodes".format(formatted_value, abbreviation)
-            return "{} nodes".format(stat_value)
+            return "{} nodes".format(abbreviate(stat_value, LARGE_NUMBER_ABBREVIATIONS))
         elif stat_name == "score":
             try:
                 score = stat_value[1]
@@ -191,13 +581,7 @@ class EngineWrapper:
         elif stat_name == "depth":
             return "Depth: {} ply".format(stat_value)
         elif stat_name == "tbhits":
-            for size, abbreviation in LARGE_NUMBER_ABBREVIATIONS.items():
-                if stat_value >= size:
-                    formatted_value = round(stat_value / size, 1)
-                    if round(formatted_value) >= 10:
-                        formatted_value = round(formatted_value)
-                    return "{}{} tb hits".format(formatted_value, abbreviation)
-            return "{} tb hits".format(stat_value)
+            return "{} tb hits".format(abbreviate(stat_value, LARGE_NUMBER_ABBREVIATIONS))
         else:
             return "{}: {}".format(stat_name, stat_value)
 
@@ -221,17 +605,30 @@ class EngineWrapper:
 
 class UCIEngine(EngineWrapper):
 
-    def __init__(self, board, commands, options, game_end_conditions, silence_stderr=False, ponder_on=False):
+    def __init__(self, board, commands, options, game_end_conditions, silence_stderr=False, ponder_on=False,
+                 speculation=None, info_lines="latest"):
         super().__init__(board, commands, options, game_end_conditions, silence_stderr, ponder_on)
-        commands = commands[0] if len(commands) == 1 else commands
+        self.commands = commands[0] if len(commands) == 1 else commands
+        self.info_lines = info_lines
         self.go_commands = options.get("go_commands", {})
         self.move_overhead = options.get("Move Overhead", XBOARD_MOVE_OVERHEAD)
+        self.node_budget = None
 
-        self.engine = chess.uci.popen_engine(commands, stderr=subprocess.DEVNULL if silence_stderr else None)
-        self.engine.uci()
+        self.start_engine(board)
 
-        if options:
-            self.engine.setoption(options)
+        self.ponder_command = False
+        self.ponder_board = chess.Board()
+
+        self.speculator = None
+        if speculation and speculation.get("enabled"):
+            self.speculator = Speculator(board, self.commands, options, speculation, silence_stderr, info_lines)
+
+    def start_engine(self, board, timeout=None):
+        self.engine = popen_uci_engine(self.commands, self.silence_stderr, self.info_lines)
+        self.engine.uci(async_callback=True).result(timeout=timeout)
+
+        if self.options:
+            self.engine.setoption(self.options)
 
         self.engine.setoption({
             "UCI_Variant": type(board).uci_variant,
@@ -243,8 +640,9 @@ class UCIEngine(EngineWrapper):
         info_handler = chess.uci.InfoHandler()
         self.engine.info_handlers.append(info_handler)
 
-        self.ponder_command = False
-        self.ponder_board = chess.Board()
+    def heartbeat(self):
+        # engines answer isready immediately, even while searching.
+        self.engine.isready(async_callback=True).result(timeout=self.heartbeat_timeout)
 
     def first_search(self, board, movetime):
         self.engine.position(board)
@@ -252,6 +650,11 @@ class UCIEngine(EngineWrapper):
         self.did_first_move = True
         return best_move
 
+    def fixed_search(self, board, nodes=None, movetime=None):
+        self.engine.position(board)
+        best_move, _ = self.engine.go(nodes=nodes, movetime=movetime)
+        return best_move
+
     def search(self, board, wtime, btime, winc, binc):
         search_start_time = time.time()
         cmds = self.go_commands
@@ -265,22 +668,45 @@ class UCIEngine(EngineWrapper):
         ponder_move = None
 
         if self.ponder_command:
-            if self.ponder_board.fen() == board.fen():
-                self.engine.ponderhit()
-                while not self.ponder_command.done():
+            self.ponder_searches += 1
+            try:
+                # the ponder search may have been stopped meanwhile (e.g. by a superseded move request).
+                if self.ponder_board.fen() == board.fen() and not self.ponder_command.done() and \
+                        not self.engine.idle:
+                    self.ponder_hits += 1
+                    self.engine.ponderhit()
+                    best_move, ponder_move = self.wait_for_search(self.ponder_command)
                     if self.is_game_over:
                         return
-                best_move, ponder_move = self.ponder_command.result()
-            else:
-                self.engine.stop()
+                else:
+                    self.engine.stop()
+            except chess.uci.EngineStateException:
+                pass  # it ended between the check and the ponderhit, a fresh search follows
+            except ENGINE_FAILURES:
+                self.restart(board)
 
             self.ponder_command = False
 
-        if best_move is None:
+        info = None
+        if self.speculator is not None:
+            if best_move is None:
+                best_move, info = self.speculator.lookup(board)
+                if best_move is not None and len(info["pv"].get(1, [])) > 1:
+                    ponder_move = info["pv"][1][1]
+            self.speculator.cancel()
+
+        def go():
+            # the clock keeps running while a crashed engine is replaced.
+            elapsed = int(1000 * (time.time() - search_start_time))
             self.engine.position(board)
-            callback = self.engine.go(
-                wtime=wtime,
-                btime=btime,
+            if self.node_budget is not None:
+                time_left = max(0, (wtime if board.turn == chess.WHITE else btime) - elapsed)
+                nodes, movetime = self.node_budget.allot(time_left, winc if board.turn == chess.WHITE else binc)
+                self.engine.node_budget = self.node_budget
+                return self.engine.go(depth=cmds.get("depth"), nodes=nodes, movetime=movetime, async_callback=True)
+            return self.engine.go(
+                wtime=max(0, wtime - elapsed) if board.turn == chess.WHITE else wtime,
+                btime=max(0, btime - elapsed) if board.turn == chess.BLACK else btime,
                 winc=winc,
                 binc=binc,
                 depth=cmds.get("depth"),
@@ -289,17 +715,27 @@ class UCIEngine(EngineWrapper):
                 async_callback=True
             )
 
-            while not callback.done():
-                if self.is_game_over:
-                    return
-            best_move, ponder_move = callback.result()
+        if best_move is None:
+            # blocks without spinning, the engine is stopped if the game ends or the search is superseded.
+            best_move, ponder_move = self.supervised_search(board, go)
+            if self.is_game_over:
+                return
 
+        info = info or self.engine.read_info()
         try:
-            score = self.engine.info_handlers[0].info["score"][1]
+            score = info["score"][1]
             score = score.cp if score.cp is not None else MATE_SCORE * score.mate
             self.past_scores.append(score)
         except (KeyError, AttributeError):
-            self.past_scores = []  # reset the past scores so nothing will screw up if engine doesn't report score
+            score = None
+            self.past_scores.clear()  # reset the past scores so nothing will screw up if engine doesn't report score
+        search_time = time.time() - search_start_time
+        self.record_score(board, score, search_time, info.get("nodes"))
+        self.last_stats = self.get_handler_stats(info, ["depth", "nps", "nodes", "tbhits", "score"])
+        self.last_search = {"depth": info.get("depth"), "nps": info.get("nps")}
+        if self.engine.node_budget is not None:
+            self.engine.node_budget = None
+            self.node_budget.searched_nodes += info.get("nodes", 0)
 
         if self.ponder_on and ponder_move is not None:
 
@@ -319,6 +755,12 @@ class UCIEngine(EngineWrapper):
                 self.ponder_board.push(ponder_move)
                 self.ponder(self.ponder_board, wtime, btime, winc, binc)
 
+        if self.speculator is not None:
+            # the main engine already ponders on its own ponder move.
+            next_board = board.copy()
+            next_board.push(best_move)
+            self.speculator.speculate(next_board, ponder_move if self.ponder_command else None)
+
         draw, resign = self.process_endgame_conditions(board)
         return best_move, draw, resign
 
@@ -338,38 +780,175 @@ class UCIEngine(EngineWrapper):
             async_callback=True
         )
 
-    def stop(self):
-        self.engine.stop()
+    def get_state(self):
+        state = super().get_state()
+        if self.ponder_command:
+            state["ponder_move"] = self.ponder_board.peek().uci()
+        return state
+
+    def resume_ponder(self, board, ponder_move, wtime, btime, winc, binc):
+        self.ponder_board = board.copy()
+        self.ponder_board.push(ponder_move)
+        self.ponder(self.ponder_board, wtime, btime, winc, binc)
+
+    def quit(self):
+        if self.speculator is not None:
+            self.speculator.quit()
+        super().quit()
+
+    def get_speculation_stats(self):
+        return self.speculator.get_stats() if self.speculator is not None else None
+
+    def get_node_budget_stats(self):
+        return self.node_budget.get_stats() if self.node_budget is not None else None
+
+    def is_pondering(self):
+        return bool(self.ponder_command)
 
     def print_stats(self):
-        self.print_handler_stats(self.engine.info_handlers[0].info,
-                                 ["string", "depth", "nps", "nodes", "tbhits", "score"])
+        self.print_handler_stats(self.engine.read_info(), ["string", "depth", "nps", "nodes", "tbhits", "score"])
 
     def get_stats(self):
-        return self.get_handler_stats(self.engine.info_handlers[0].info,
-                                      ["depth", "nps", "nodes", "tbhits", "score"])
+        return self.get_handler_stats(self.engine.read_info(), ["depth", "nps", "nodes", "tbhits", "score"])
+
+    def get_info_line_stats(self):
+        return {"info_lines": self.engine.info_lines, "parsed_lines": self.engine.parsed_lines}
+
+
+class Speculator:
+    """Searches the most likely opponent replies on helper engines while the opponent thinks.
+
+    The best response to every reply is cached by the Zobrist hash of the resulting position. If the opponent plays
+    one of those replies, the cached response is played instantly instead of searching."""
+
+    def __init__(self, board, commands, options, config, silence_stderr=False, info_lines="latest"):
+        self.replies = config.get("replies", 3)
+        self.nodes = config.get("nodes", 200000)
+        self.engines = []
+        self.idle_engines = queue.Queue()
+        for _ in range(config.get("engines", 1)):
+            engine = popen_uci_engine(commands, silence_stderr, info_lines)
+            engine.uci()
+            engine.setoption({name: value for name, value in options.items() if name != "go_commands"})
+            engine.setoption({"UCI_Variant": type(board).uci_variant, "UCI_Chess960": board.chess960})
+            engine.info_handlers.append(chess.uci.InfoHandler())
+            self.engines.append(engine)
+            self.idle_engines.put(engine)
+        self.executor = ThreadPoolExecutor(len(self.engines))
+
+        self.cache = {}
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.search_time = 0
+        self.lock = threading.Lock()
+
+    def speculate(self, board, exclude=None):
+        """Starts searching the replies in `board`, the position after our move."""
+        self.generation += 1
+        self.cache = {}
+        self.executor.submit(self._speculate, board.copy(), exclude, self.generation)
+
+    def lookup(self, board):
+        """The cached response and its info for the position, or (None, None)."""
+        cached = self.cache.get(chess.polyglot.zobrist_hash(board))
+        if cached is None:
+            self.misses += 1
+            return None, None
+        self.hits += 1
+        return cached
+
+    def cancel(self):
+        self.generation += 1
+        for engine in self.engines:
+            engine.stop(async_callback=True)
+
+    def quit(self):
+        self.cancel()
+        self.executor.shutdown(wait=False)
+        for engine in self.engines:
+            engine.quit()
+
+    def get_stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "lookups": total, "hit_rate": self.hits / total if total else 0,
+                "search_time": self.search_time}
+
+    def _search(self, board, nodes, multipv=1):
+        engine = self.idle_engines.get()
+        start = time.time()
+        try:
+            if multipv > 1:
+                engine.setoption({"MultiPV": multipv})
+            engine.position(board)
+            best_move, _ = engine.go(nodes=nodes)
+            info = engine.read_info()
+            return best_move, {"score": dict(info["score"]), "pv": dict(info["pv"]), "nodes": info.get("nodes")}
+        finally:
+            if multipv > 1:
+                engine.setoption({"MultiPV": 1})
+            # wall time of the helper searches, which run on several threads.
+            with self.lock:
+                self.search_time += time.time() - start
+            self.idle_engines.put(engine)
+
+    def _speculate(self, board, exclude, generation):
+        if generation != self.generation:
+            return  # cancelled while queued, the real search needs the CPU
+        # a short multipv search finds the likely replies, then each one is searched on its own.
+        _, info = self._search(board, self.nodes // 4, self.replies)
+        if generation != self.generation:
+            return
+        replies = [line[0] for _, line in sorted(info["pv"].items()) if line]
+
+        for reply in replies:
+            if reply == exclude:
+                continue
+            self.executor.submit(self._speculate_reply, board, reply, generation)
+
+    def _speculate_reply(self, board, reply, generation):
+        if generation != self.generation:
+            return
+        board = board.copy()
+        board.push(reply)
+        best_move, info = self._search(board, self.nodes)
+        if generation == self.generation and best_move is not None:
+            self.cache[chess.polyglot.zobrist_hash(board)] = (best_move, info)
 
 
 class XBoardEngine(EngineWrapper):
 
     def __init__(self, board, commands, options, game_end_conditions, silence_stderr=False, ponder_on=False):
         super().__init__(board, commands, options, game_end_conditions, silence_stderr, ponder_on)
-        commands = commands[0] if len(commands) == 1 else commands
-        self.engine = chess.xboard.popen_engine(commands, stderr=subprocess.DEVNULL if silence_stderr else None)
-        self.engine.xboard()
+        self.commands = commands[0] if len(commands) == 1 else commands
+        self.time_control = None
+        self.start_engine(board)
+
+    def start_engine(self, board, timeout=None):
+        self.engine = chess.xboard.popen_engine(self.commands,
+                                                stderr=subprocess.DEVNULL if self.silence_stderr else None)
+        self.engine.xboard(async_callback=True).result(timeout=timeout)
 
         if board.chess960:
             self.engine.send_variant("fischerandom")
         elif type(board).uci_variant != "chess":
             self.engine.send_variant(type(board).uci_variant)
 
-        if options:
-            self._handle_options(options)
+        if self.options:
+            self._handle_options(self.options)
+
+        if self.time_control is not None:
+            self.engine.level(*self.time_control)
+
+        if self.ponder_on:
+            self.engine.hard()
 
         self.engine.setboard(board)
 
         post_handler = chess.xboard.PostHandler()
         self.engine.post_handlers.append(post_handler)
+        # the position after our last move while the engine ponders on it.
+        self.ponder_board = None
 
     def _handle_options(self, options):
         for option, value in options.items():
@@ -394,7 +973,9 @@ class XBoardEngine(EngineWrapper):
         minutes = game.clock_initial / 1000 / 60
         seconds = game.clock_initial / 1000 % 60
         inc = game.clock_increment / 1000
-        self.engine.level(0, minutes, seconds, inc)
+        # kept to set up a restarted engine.
+        self.time_control = (0, minutes, seconds, inc)
+        self.engine.level(*self.time_control)
 
     def first_search(self, board, movetime):
         self.engine.setboard(board)
@@ -403,33 +984,100 @@ class XBoardEngine(EngineWrapper):
         self.did_first_move = True
         return bestmove
 
-    def search(self, board, wtime, btime, winc, binc):
-        self.engine.force()
-        try:
-            self.engine.usermove(board.peek())
-        except IndexError:
-            self.engine.setboard(board)
+    def fixed_search(self, board, nodes=None, movetime=None):
+        # xboard has no node limit, so only the move time is used.
+        self.engine.setboard(board)
+        self.engine.st(movetime / 1000)
+        return self.engine.go()
+
+    def is_ponder_hit(self, board):
+        """Whether the opponent's last move in `board` is the one the engine pondered on (its hint)."""
+        opponent_move = board.peek()
+        hint = self.engine.ponder_move
+        return hint is not None and hint in (opponent_move.uci(), self.ponder_board.san(opponent_move))
+
+    def continues_ponder(self, board):
+        """Whether `board` is the pondered position plus the opponent's move."""
+        if self.ponder_board is None or not board.move_stack:
+            return False
+        previous = board.copy(stack=1)
+        previous.pop()
+        return previous.fen() == self.ponder_board.fen()
 
+    def search(self, board, wtime, btime, winc, binc):
+        search_start_time = time.time()
         if board.turn == chess.WHITE:
             wtime = max(0, wtime - XBOARD_MOVE_OVERHEAD)
-            self.engine.time(wtime / 10)
-            self.engine.otim(btime / 10)
         else:
             btime = max(0, btime - XBOARD_MOVE_OVERHEAD)
-            self.engine.time(btime / 10)
-            self.engine.otim(wtime / 10)
-        best_move = self.engine.go()
+
+        # while pondering the engine isn't in force mode, so the opponent's move starts its search right away and it
+        # keeps what it pondered if the move was its hint.
+        pondering = self.continues_ponder(board)
+        if pondering:
+            self.ponder_searches += 1
+            self.ponder_hits += self.is_ponder_hit(board)
+        self.ponder_board = None
+
+        if not self.engine.is_alive():
+            pondering = False
+            self.restart(board)  # died while the opponent was thinking, the new engine is set up with the position
+        elif not pondering:
+            self.engine.force()
+            try:
+                self.engine.usermove(board.peek())
+            except IndexError:
+                self.engine.setboard(board)
+
+        def go():
+            nonlocal pondering
+            elapsed = int(1000 * (time.time() - search_start_time))
+            if board.turn == chess.WHITE:
+                self.engine.time(max(0, wtime - elapsed) / 10)
+                self.engine.otim(btime / 10)
+            else:
+                self.engine.time(max(0, btime - elapsed) / 10)
+                self.engine.otim(wtime / 10)
+            if pondering:
+                pondering = False  # a restarted engine is started with go
+                return self.engine.usermove(board.peek(), async_callback=True)
+            return self.engine.go(async_callback=True)
+
+        best_move = self.supervised_search(board, go)
+        if self.is_game_over:
+            return
 
         try:
-            score = self.engine.post_handlers[0].post["score"][1]
-            score = score.cp if score.cp is not None else MATE_SCORE * score.mate
+            # xboard engines post the score in centipawns.
+            score = self.engine.post_handlers[0].post["score"]
             self.past_scores.append(score)
-        except (KeyError, AttributeError):
-            self.past_scores = []  # reset the past scores so nothing will screw up if engine doesn't report score
+        except KeyError:
+            score = None
+            self.past_scores.clear()  # reset the past scores so nothing will screw up if engine doesn't report score
+        search_time = time.time() - search_start_time
+        post = self.engine.post_handlers[0].post
+        self.record_score(board, score, search_time, post.get("nodes"))
+        self.last_stats = self.get_stats()
+        # the time is posted in centiseconds.
+        nps = 100 * post["nodes"] // post["time"] if post.get("time") and "nodes" in post else None
+        self.last_search = {"depth": post.get("depth"), "nps": nps}
+
+        if self.ponder_on:
+            remaining = (wtime if board.turn == chess.WHITE else btime) - int(1000 * search_time)
+            if remaining >= XBOARD_MOVE_OVERHEAD:
+                self.ponder_board = board.copy()
+                self.ponder_board.push(best_move)
+                # go and usermove leave force mode, the engine now ponders until the opponent's usermove.
+                self.engine.in_force = False
+            else:
+                self.engine.force()  # not enough time to think on the opponent's time
 
         draw, resign = self.process_endgame_conditions(board)
         return best_move, draw, resign
 
+    def is_pondering(self):
+        return self.ponder_board is not None
+
     def print_stats(self):
         self.print_handler_stats(self.engine.post_handlers[0].post, ["depth", "nodes", "score"])
 
@@ -1,3 +1,4 @@
+import os
 from urllib.parse import urljoin
 
 import requests
@@ -12,6 +13,8 @@ except ImportError:
 
 import backoff
 
+from src import recorder
+
 ENDPOINTS = {
     "profile": "/api/account",
     "playing": "/api/account/playing",
@@ -37,22 +40,25 @@ def is_final(exception):
 
 # docs: https://lichess.org/api
 class Lichess:
-    def __init__(self, token, url, version):
+    def __init__(self, token, url, version, session=None, record_dir=None):
         self.version = version
         self.header = {
             "Authorization": "Bearer {}".format(token)
         }
 
         self.baseUrl = url
-        self.session = requests.Session()
-        self.session.headers.update(self.header)
+        # the session may be shared between several accounts so that they reuse one connection pool. the
+        # authorization header is therefore sent with every request instead of being stored on the session.
+        self.session = session or requests.Session()
+        # the raw streams are recorded here for `python -m src.replay`.
+        self.record_dir = record_dir
         self.set_user_agent("?")
 
     @backoff.on_exception(backoff.expo, (RemoteDisconnected, ConnectionError, ProtocolError, HTTPError), max_time=120,
                           giveup=is_final)
     def api_get(self, path):
         url = urljoin(self.baseUrl, path)
-        response = self.session.get(url)
+        response = self.session.get(url, headers=self.header)
         response.raise_for_status()
         return response.json()
 
@@ -60,7 +66,7 @@ class Lichess:
                           giveup=is_final)
     def api_post(self, path, data=None, params=None):
         url = urljoin(self.baseUrl, path)
-        response = self.session.post(url, data=data, params=params)
+        response = self.session.post(url, data=data, params=params, headers=self.header)
         response.raise_for_status()
         return response.json()
 
@@ -83,11 +89,17 @@ class Lichess:
 
     def get_event_stream(self):
         url = urljoin(self.baseUrl, ENDPOINTS["stream_event"])
-        return requests.get(url, headers=self.header, stream=True)
+        response = requests.get(url, headers=self.header, stream=True)
+        if self.record_dir:
+            return recorder.RecordingResponse(response, os.path.join(self.record_dir, recorder.EVENTS_FILE))
+        return response
 
     def get_game_stream(self, game_id):
         url = urljoin(self.baseUrl, ENDPOINTS["stream"].format(game_id))
-        return requests.get(url, headers=self.header, stream=True)
+        response = requests.get(url, headers=self.header, stream=True)
+        if self.record_dir:
+            return recorder.RecordingResponse(response, os.path.join(self.record_dir, recorder.game_file(game_id)))
+        return response
 
     def accept_challenge(self, challenge_id):
         return self.api_post(ENDPOINTS["accept"].format(challenge_id))
@@ -98,6 +110,8 @@ class Lichess:
     def get_profile(self):
         profile = self.api_get(ENDPOINTS["profile"])
         self.set_user_agent(profile["username"])
+        if self.record_dir:
+            recorder.save_profile(self.record_dir, profile)
         return profile
 
     def get_ongoing_games(self):
@@ -109,4 +123,3 @@ class Lichess:
 
     def set_user_agent(self, username):
         self.header.update({"User-Agent": "lichess-bot/{} user:{}".format(self.version, username)})
-        self.session.headers.update(self.header)
@@ -1,6 +1,13 @@
+import logging
 import multiprocessing
+import os
 import traceback
-from multiprocessing.pool import Pool
+from multiprocessing import util
+from multiprocessing.pool import ExceptionWithTraceback, MaybeEncodingError, Pool, _helper_reraises_exception, worker
+
+from src import memory
+
+logger = logging.getLogger(__name__)
 
 
 # Shortcut to multiprocessing's logger
@@ -29,7 +36,67 @@ class LogExceptions(object):
         return result
 
 
+def recycling_worker(inqueue, outqueue, initializer=None, initargs=(), maxtasks=None, wrap_exception=False,
+                     max_rss=None):
+    """`multiprocessing.pool.worker`, which also exits once the result of a task is sent if the task left the worker
+    with more than `max_rss` bytes resident, like it does after `maxtasks` tasks. The pool starts a new worker in its
+    place."""
+    put = outqueue.put
+    get = inqueue.get
+    if hasattr(inqueue, '_writer'):
+        inqueue._writer.close()
+        outqueue._reader.close()
+
+    if initializer is not None:
+        initializer(*initargs)
+
+    completed = 0
+    while maxtasks is None or (maxtasks and completed < maxtasks):
+        try:
+            task = get()
+        except (EOFError, OSError):
+            util.debug('worker got EOFError or OSError -- exiting')
+            break
+
+        if task is None:
+            util.debug('worker got sentinel -- exiting')
+            break
+
+        job, i, func, args, kwds = task
+        try:
+            result = (True, func(*args, **kwds))
+        except Exception as e:
+            if wrap_exception and func is not _helper_reraises_exception:
+                e = ExceptionWithTraceback(e, e.__traceback__)
+            result = (False, e)
+        try:
+            put((job, i, result))
+        except Exception as e:
+            wrapped = MaybeEncodingError(e, result[1])
+            util.debug("Possible encoding error while sending result: %s" % (wrapped))
+            put((job, i, (False, wrapped)))
+
+        task = job = result = func = args = kwds = None
+        completed += 1
+        if max_rss and memory.rss() > max_rss:
+            logger.info("Replacing worker {} using {:.0f} MB".format(os.getpid(), memory.megabytes(memory.rss())))
+            break
+    util.debug('worker exiting after %d tasks' % completed)
+
+
 class LoggingPool(Pool):
+    def __init__(self, processes=None, max_tasks=None, max_rss=None):
+        """Workers are replaced after `max_tasks` tasks, or after a task that left them with more than `max_rss` bytes
+        resident."""
+        self.max_rss = max_rss
+        super().__init__(processes, maxtasksperchild=max_tasks)
+
+    def Process(self, ctx, *args, **kwds):
+        if kwds.get("target") is worker:
+            kwds["target"] = recycling_worker
+            kwds["args"] = tuple(kwds["args"]) + (self.max_rss,)
+        return super().Process(ctx, *args, **kwds)
+
     def apply_async(self, func, args=(), kwargs=None, callback=None, error_callback=None):
         if kwargs is None:
             kwargs = {}
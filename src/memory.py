@@ -0,0 +1,48 @@
+"""
+Memory accounting of the bot's processes, to recycle the pool workers and trim the manager process.
+"""
+
+import ctypes
+import ctypes.util
+import gc
+import os
+import sys
+from multiprocessing.managers import SyncManager
+
+
+def rss():
+    """The resident set size of this process in bytes."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # no procfs (e.g. macOS), the peak is the best there is. it's in bytes on macOS and in kilobytes elsewhere.
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def compact():
+    """Collects the garbage and hands the free heap back to the system (with glibc). Returns the RSS after that.
+
+    Only memory that is already free is returned, live objects (like the shared queues and lists) aren't shrunk."""
+    gc.collect()
+    libc = ctypes.util.find_library("c")
+    if libc:
+        try:
+            ctypes.CDLL(libc).malloc_trim(0)
+        except (OSError, AttributeError):
+            pass  # not glibc
+    return rss()
+
+
+def megabytes(size):
+    return size / (1024 * 1024)
+
+
+class BotManager(SyncManager):
+    """The manager of the shared queues, which can also be told to collect its garbage and trim its heap:
+    `manager.compact()._getvalue()` returns its RSS after that."""
+
+
+BotManager.register("compact", callable=compact)
@@ -3,20 +3,44 @@ from urllib.parse import urljoin
 
 
 class Challenge:
+    """A challenge as the scheduler needs it. Challenges are pickled every time the shared challenge queue changes, so
+    only these fields are kept (and pickled as a plain tuple); everything else is derived when asked for."""
+
+    __slots__ = ("id", "rated", "variant", "perf_name", "speed", "increment", "limit", "challenger_name",
+                 "challenger_title", "challenger_rating_int")
+
     def __init__(self, c_info):
         self.id = c_info["id"]
         self.rated = c_info["rated"]
         self.variant = c_info["variant"]["key"]
         self.perf_name = c_info["perf"]["name"]
         self.speed = c_info["speed"]
-        self.increment = c_info.get("timeControl", {}).get("increment", -1)
-        self.challenger = c_info.get("challenger")
-        self.challenger_title = self.challenger.get("title") if self.challenger else None
-        self.challenger_is_bot = self.challenger_title == "BOT"
-        self.challenger_master_title = self.challenger_title if not self.challenger_is_bot else None
-        self.challenger_name = self.challenger["name"] if self.challenger else "Anonymous"
-        self.challenger_rating_int = self.challenger["rating"] if self.challenger else 0
-        self.challenger_rating = self.challenger_rating_int or "?"
+        time_control = c_info.get("timeControl", {})
+        self.increment = time_control.get("increment", -1)
+        self.limit = time_control.get("limit", -1)
+        challenger = c_info.get("challenger")
+        self.challenger_name = challenger["name"] if challenger else "Anonymous"
+        self.challenger_title = challenger.get("title") if challenger else None
+        self.challenger_rating_int = challenger["rating"] if challenger else 0
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+    @property
+    def challenger_is_bot(self):
+        return self.challenger_title == "BOT"
+
+    @property
+    def challenger_master_title(self):
+        return self.challenger_title if not self.challenger_is_bot else None
+
+    @property
+    def challenger_rating(self):
+        return self.challenger_rating_int or "?"
 
     def is_supported_variant(self, supported):
         return self.variant in supported
@@ -66,6 +90,10 @@ class Challenge:
 
 
 class Game:
+    __slots__ = ("username", "id", "speed", "clock_initial", "clock_increment", "perf_name", "variant_name",
+                 "variant_key", "white", "black", "initial_fen", "white_starts", "state", "is_white", "base_url",
+                 "abort_at")
+
     def __init__(self, json, username, base_url, abort_time):
         self.username = username
         self.id = json.get("id")
@@ -75,19 +103,32 @@ class Game:
         self.clock_increment = clock.get("increment", 0)
         self.perf_name = json.get("perf").get("name") if json.get("perf") else "{perf?}"
         self.variant_name = json.get("variant")["name"]
+        self.variant_key = json.get("variant")["key"]
         self.white = Player(json.get("white"))
         self.black = Player(json.get("black"))
         self.initial_fen = json.get("initialFen")
+        self.white_starts = self.initial_fen == "startpos" or self.initial_fen.split()[1] == "w"
         self.state = json.get("state")
         self.is_white = bool(self.white.name and self.white.name.lower() == username.lower())
-        self.my_color = "white" if self.is_white else "black"
-        self.opponent_color = "black" if self.is_white else "white"
-        self.me = self.white if self.is_white else self.black
-        self.opponent = self.black if self.is_white else self.white
         self.base_url = base_url
-        self.white_starts = self.initial_fen == "startpos" or self.initial_fen.split()[1] == "w"
         self.abort_at = time.time() + abort_time
 
+    @property
+    def my_color(self):
+        return "white" if self.is_white else "black"
+
+    @property
+    def opponent_color(self):
+        return "black" if self.is_white else "white"
+
+    @property
+    def me(self):
+        return self.white if self.is_white else self.black
+
+    @property
+    def opponent(self):
+        return self.black if self.is_white else self.white
+
     def url(self):
         return urljoin(self.base_url, "{}/{}".format(self.id, self.my_color))
 
@@ -101,6 +142,16 @@ class Game:
     def should_abort_now(self):
         return self.is_abortable() and time.time() > self.abort_at
 
+    def result(self):
+        """Our score in a finished game (1, 0.5 or 0), or None if the game is not over or was aborted."""
+        status = (self.state or {}).get("status", "started")
+        if status in ("created", "started", "aborted", "noStart"):
+            return None
+        winner = self.state.get("winner")
+        if winner is None:
+            return 0.5
+        return 1 if winner == self.my_color else 0
+
     def my_remaining_seconds(self):
         return (self.state["wtime"] if self.is_white else self.state["btime"]) / 1000
 
@@ -112,6 +163,8 @@ class Game:
 
 
 class Player:
+    __slots__ = ("id", "name", "title", "rating", "provisional", "aiLevel")
+
     def __init__(self, json):
         self.id = json.get("id")
         self.name = json.get("name")
@@ -0,0 +1,85 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class MoveRequest:
+    def __init__(self, key, move_function, run_at):
+        self.key = key
+        self.move_function = move_function
+        self.run_at = run_at
+        self.cancelled = False
+        # cleared by the move function once its search is over, the engine may be pondering after that.
+        self.searching = True
+
+
+class MoveExecutor:
+    """Runs every move of a game on one long-lived thread that owns the engine.
+
+    A newer request supersedes the pending one and cancels the running one (stopping the engine while it searches),
+    so searches never overlap. Requests can be delayed without blocking the thread that reads the game stream."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.condition = threading.Condition()
+        self.pending = None
+        self.current = None
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, key, move_function, delay=0):
+        """Schedules `move_function(request)` to run after `delay` seconds. Requests with the key of the pending or
+        running request (e.g. a repeated game state) are ignored. The move function must check `request.cancelled`
+        before sending its move, and clear `request.searching` once its search is over."""
+        with self.condition:
+            if self.closed:
+                return
+            for request in (self.pending, self.current):
+                if request is not None and not request.cancelled and request.key == key:
+                    return
+            if self.current is not None and not self.current.cancelled:
+                self.current.cancelled = True
+                if self.current.searching:
+                    self.engine.stop()
+            self.pending = MoveRequest(key, move_function, time.time() + delay)
+            self.condition.notify()
+
+    def close(self, timeout=5):
+        with self.condition:
+            self.closed = True
+            self.pending = None
+            if self.current is not None:
+                self.current.cancelled = True
+                if self.current.searching:
+                    self.engine.stop()
+            self.condition.notify()
+        self.thread.join(timeout)
+
+    def _next_request(self):
+        with self.condition:
+            while not self.closed:
+                if self.pending is None:
+                    self.condition.wait()
+                elif self.pending.run_at > time.time():
+                    self.condition.wait(self.pending.run_at - time.time())
+                else:
+                    self.current, self.pending = self.pending, None
+                    return self.current
+            return None
+
+    def _run(self):
+        while True:
+            request = self._next_request()
+            if request is None:
+                return
+            try:
+                request.move_function(request)
+            except Exception:
+                if not self.closed:
+                    logger.exception("Move failed")
+            finally:
+                with self.condition:
+                    self.current = None
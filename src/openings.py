@@ -0,0 +1,125 @@
+"""
+Precomputed first moves for fixed start positions.
+
+The first move of a game is otherwise searched for a flat 10 seconds, and Chess960 has no opening book at all. This
+module searches all 960 Chess960 start positions, the standard start position and any extra FENs once, offline, and
+stores the best moves in a compact file that the bot loads at startup (`engine.opening_table`).
+
+The file is a sorted sequence of 10-byte records: the polyglot Zobrist hash of the position and the encoded move.
+
+usage: python -m src.openings openings.bin --depth 30 [--fens fens.txt] [--replies]
+"""
+
+import argparse
+import logging
+import struct
+
+import chess
+import chess.polyglot
+
+logger = logging.getLogger(__name__)
+
+RECORD = struct.Struct(">QH")
+
+# moves are encoded as from_square * 64 + to_square, plus 4096 * promotion piece type.
+NO_MOVE = -1
+
+
+def encode_move(move):
+    if move is None:
+        return NO_MOVE
+    return move.from_square * 64 + move.to_square + 4096 * (move.promotion or 0)
+
+
+def decode_move(code):
+    if code == NO_MOVE:
+        return None
+    promotion, square = divmod(int(code), 4096)
+    return chess.Move(square // 64, square % 64, promotion or None)
+
+
+def start_positions(fens=(), replies=False):
+    """The standard start position, every Chess960 start position and the given FENs. With `replies`, also every
+    position after one move from those, so the table covers the first move with black too."""
+    boards = [chess.Board()]
+    boards.extend(chess.Board.from_chess960_pos(index) for index in range(960))
+    boards.extend(chess.Board(fen) for fen in fens)
+    if replies:
+        for board in list(boards):
+            for move in board.legal_moves:
+                reply = board.copy(stack=False)
+                reply.push(move)
+                boards.append(reply)
+
+    seen = set()
+    for board in boards:
+        key = chess.polyglot.zobrist_hash(board)
+        if key not in seen:
+            seen.add(key)
+            yield board
+
+
+def write_table(path, moves):
+    with open(path, "wb") as table_file:
+        for key in sorted(moves):
+            table_file.write(RECORD.pack(key, moves[key]))
+
+
+def load_table(path):
+    with open(path, "rb") as table_file:
+        data = table_file.read()
+    return {key: code for key, code in RECORD.iter_unpack(data)}
+
+
+def lookup(table, board):
+    """The precomputed move for the position, or None if the position isn't in the table."""
+    if type(board).uci_variant != "chess":
+        return None  # the table is searched with standard rules
+    code = table.get(chess.polyglot.zobrist_hash(board))
+    if code is None:
+        return None
+    move = decode_move(code)
+    return move if move in board.legal_moves else None
+
+
+def precompute(config, path, fens=(), workers=None, threads=1, nodes=None, depth=None, replies=False):
+    # the batch analysis pool already runs one engine per core with a fixed budget.
+    from multiprocessing import Pool, cpu_count
+    from src.analysis import init_worker, analyse_position
+
+    if nodes is None and depth is None:
+        raise ValueError("A node or depth budget is required to precompute the opening table.")
+
+    boards = list(start_positions(fens, replies))
+    logger.info("Searching {} start positions".format(len(boards)))
+    moves = {}
+    with Pool(workers or cpu_count(), initializer=init_worker, initargs=(config, threads, nodes, depth)) as pool:
+        items = ((index, 0, board) for index, board in enumerate(boards))
+        for index, _, _, _, _, _, code in pool.imap(analyse_position, items, chunksize=4):
+            if code != NO_MOVE:
+                moves[chess.polyglot.zobrist_hash(boards[index])] = code
+    write_table(path, moves)
+    logger.info("Wrote {} moves to {}".format(len(moves), path))
+
+
+if __name__ == "__main__":
+    from src.config import load_config
+
+    parser = argparse.ArgumentParser(description='Precompute the first moves of fixed start positions')
+    parser.add_argument('output', help='Opening table file to write.')
+    parser.add_argument('--config', help='Specify a configuration file (defaults to ./config.yml)')
+    parser.add_argument('--fens', help='File with extra start positions, one FEN per line.')
+    parser.add_argument('--replies', action='store_true', help='Also search every position after one move.')
+    parser.add_argument('--workers', type=int, help='Number of engine processes (defaults to the number of cores).')
+    parser.add_argument('--threads', type=int, default=1, help='Engine threads per worker.')
+    parser.add_argument('--nodes', type=int, help='Node budget per position.')
+    parser.add_argument('--depth', type=int, help='Depth budget per position.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)-15s: %(message)s")
+    FENS = []
+    if args.fens:
+        with open(args.fens) as fens_file:
+            FENS = [line.strip() for line in fens_file if line.strip()]
+    precompute(load_config(args.config or "./config.yml"), args.output, FENS, args.workers, args.threads,
+               args.nodes, args.depth, args.replies)
@@ -0,0 +1,142 @@
+"""
+Low overhead sampling profiler for the control process and the game workers.
+
+A background thread samples the stacks of all the other threads of the process and writes them in the collapsed-stack
+format (one `frame;frame;frame count` line per stack), which flamegraph.pl and speedscope read directly.
+
+Profiling is toggled with SIGUSR1 (`kill -USR1 <pid>`, or the whole process group) or with the `!profile` chat command
+of the configured owner. In continuous mode the last `window` seconds of samples are kept in a ring buffer and dumped
+automatically when a move exceeds its time budget.
+"""
+
+import collections
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+profiler = None
+current_tag = "control"
+
+
+class SamplingProfiler:
+    def __init__(self, directory, interval=0.01, continuous=False, window=30):
+        self.directory = directory
+        self.interval = interval
+        self.window = window if continuous else None
+        self.recent = collections.deque()
+        self.counts = None
+        # reentrant, the SIGUSR1 handler runs on the main thread and may interrupt a `toggle()` from the chat command.
+        self.lock = threading.RLock()
+        self.thread = None
+        if self.window:
+            self.ensure_running()
+
+    def is_recording(self):
+        return self.counts is not None
+
+    def toggle(self, tag):
+        """Starts recording, or stops it and returns the path of the written profile."""
+        with self.lock:
+            if self.counts is None:
+                self.counts = collections.Counter()
+                self.ensure_running()
+                logger.info("Profiling {} (pid {})".format(tag, os.getpid()))
+                return None
+            counts, self.counts = self.counts, None
+        return self.dump(tag, counts)
+
+    def dump_recent(self, tag):
+        """Writes the samples of the last `window` seconds, if running in continuous mode."""
+        if not self.window:
+            return None
+        with self.lock:
+            counts = collections.Counter(stack for _, stack in self.recent)
+        return self.dump("{}-slow".format(tag), counts)
+
+    def dump(self, tag, counts):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, "{}-{}-{}.folded".format(tag, os.getpid(), time.strftime("%Y%m%d%H%M%S")))
+        with open(path, "w") as profile_file:
+            for stack, count in counts.most_common():
+                profile_file.write("{} {}\n".format(stack, count))
+        logger.info("Wrote profile {} ({} samples)".format(path, sum(counts.values())))
+        return path
+
+    def after_fork(self):
+        """Called in every forked child: the lock may have been held by the parent's sampling thread, which doesn't
+        exist in the child, so the child gets a new lock, samples and thread of its own."""
+        self.lock = threading.RLock()
+        self.recent = collections.deque()
+        self.counts = None
+        self.thread = None
+        if self.window:
+            self.ensure_running()
+
+    def ensure_running(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while self.window or self.counts is not None:
+            now = time.time()
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks = [collapse(names.get(thread_id, "thread"), frame)
+                      for thread_id, frame in sys._current_frames().items() if thread_id != own_id]
+            with self.lock:
+                if self.counts is not None:
+                    self.counts.update(stacks)
+                if self.window:
+                    self.recent.extend((now, stack) for stack in stacks)
+                    while self.recent and self.recent[0][0] < now - self.window:
+                        self.recent.popleft()
+            time.sleep(self.interval)
+
+
+def collapse(thread_name, frame):
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append("{} ({}:{})".format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+        frame = frame.f_back
+    frames.append(thread_name)
+    return ";".join(reversed(frames))
+
+
+def setup(config):
+    """Creates the profiler of this process and installs the SIGUSR1 handler. Forked workers inherit the handler and
+    reset the profiler to their own."""
+    global profiler
+    if not config.get("enabled", False):
+        return
+    profiler = SamplingProfiler(config.get("dir", "./profiles"), config.get("interval", 0.01),
+                                config.get("continuous", False), config.get("window", 30))
+    os.register_at_fork(after_in_child=profiler.after_fork)
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: toggle())
+
+
+def set_tag(tag):
+    global current_tag
+    current_tag = tag
+    if profiler is not None and profiler.window:
+        # in case the sampling thread died.
+        profiler.ensure_running()
+
+
+def toggle():
+    if profiler is not None:
+        return profiler.toggle(current_tag)
+    return None
+
+
+def dump_recent():
+    if profiler is not None:
+        return profiler.dump_recent(current_tag)
+    return None
@@ -0,0 +1,53 @@
+"""
+Recordings of the raw Lichess streams, to replay real traffic with `python -m src.replay`.
+
+With `record_streams` set to a directory, the event stream and every game stream are written there as they are
+consumed: one line per received line, the arrival time and the raw ndjson bytes separated by a space (keep-alive
+lines are recorded empty). The profile is saved too, so the replay knows which side the bot plays.
+"""
+
+import json
+import os
+import time
+
+EVENTS_FILE = "events.ndjson"
+PROFILE_FILE = "profile.json"
+
+
+def game_file(game_id):
+    return "game-{}.ndjson".format(game_id)
+
+
+def save_profile(directory, profile):
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, PROFILE_FILE), "w") as profile_file:
+        json.dump(profile, profile_file)
+
+
+def read_recording(path):
+    """The (arrival time, raw line) pairs of a recorded stream."""
+    lines = []
+    with open(path, "rb") as recording:
+        for record in recording:
+            timestamp, _, line = record.rstrip(b"\n").partition(b" ")
+            lines.append((float(timestamp), line))
+    return lines
+
+
+class RecordingResponse:
+    """A streamed response that appends every line it yields to a recording."""
+
+    def __init__(self, response, path):
+        self.response = response
+        self.path = path
+
+    def iter_lines(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "ab") as recording:
+            for line in self.response.iter_lines():
+                recording.write(b"%.3f %s\n" % (time.time(), line))
+                recording.flush()
+                yield line
+
+    def __getattr__(self, name):
+        return getattr(self.response, name)
@@ -0,0 +1,248 @@
+"""
+Replays streams recorded with `record_streams` through the bot's own event and game handling.
+
+The recorded event stream is fed to `watch_control_stream` and the control loop, and every game it starts runs
+`play_game` on the recorded game stream, with the lines delivered at their recorded pace (or `--speed` times faster).
+Moves, chat and challenge answers go nowhere and the engine is a stub that plays instantly (or after `--think`
+milliseconds), so two versions of the bot can be compared on exactly the same input.
+
+The move latency is measured from the game stream line that made it our turn to the move being sent, and the memory
+growth per game from the start of every game to its end (after collecting the garbage), so leaks show up in replays.
+
+usage: python -m src.replay recordings/ [--speed 10] [--think 0] [--config config.yml]
+"""
+
+import argparse
+import glob
+import importlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+import requests
+import yaml
+
+from src import recorder
+from src.account import Account
+from src.admission import AdmissionWorkers
+from src.engine_wrapper import EngineWrapper, DRAW_CONDITIONS, RESIGNATION_CONDITIONS
+
+logger = logging.getLogger(__name__)
+
+CONFIG = {
+    "url": "https://lichess.org/",
+    "engine": {},
+    "abort_time": 20,
+    "challenge": {
+        "concurrency": 4,
+        "variants": ["standard", "fromPosition", "antichess", "atomic", "chess960", "crazyhouse", "horde",
+                     "kingOfTheHill", "racingKings", "threeCheck"],
+        "time_controls": ["ultraBullet", "bullet", "blitz", "rapid", "classical"],
+        "modes": ["casual", "rated"],
+        "accept_bot": True,
+    },
+}
+
+
+class StubEngine(EngineWrapper):
+    """Plays the first legal move in UCI order, after `think` seconds."""
+
+    def __init__(self, board, think=0):
+        super().__init__(board, [], {}, {"draw": DRAW_CONDITIONS, "resignation": RESIGNATION_CONDITIONS})
+        self.think = think
+
+    def _move(self, board):
+        time.sleep(self.think)
+        return min(board.legal_moves, key=lambda move: move.uci())
+
+    def first_search(self, board, movetime):
+        self.did_first_move = True
+        return self._move(board)
+
+    def fixed_search(self, board, nodes=None, movetime=None):
+        return self._move(board)
+
+    def search(self, board, wtime, btime, winc, binc):
+        start = time.time()
+        move = self._move(board)
+        self.record_score(board, None, time.time() - start)
+        return move, False, False
+
+    def name(self):
+        return "stub"
+
+    def stop(self):
+        pass
+
+    def quit(self):
+        pass
+
+    def get_stats(self):
+        return []
+
+
+class ReplayResponse:
+    def __init__(self, replay_li, lines, game_id=None):
+        self.replay_li = replay_li
+        self.lines = lines
+        self.game_id = game_id
+        self.status_code = 200
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            response = requests.Response()
+            response.status_code = self.status_code
+            raise requests.HTTPError("{} for the stream of {}".format(self.status_code, self.game_id),
+                                     response=response)
+
+    def close(self):
+        pass
+
+    def iter_lines(self):
+        for timestamp, line in self.lines:
+            delay = self.replay_li.due(timestamp) - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            if self.game_id is not None:
+                self.replay_li.line_received(self.game_id)
+            yield line
+        if self.game_id is None:
+            self.replay_li.events_done.set()
+
+
+class ReplayLichess:
+    """Stands in for `lichess.Lichess`: serves the recorded streams and measures the answers to them."""
+
+    def __init__(self, directory, speed=1):
+        self.directory = directory
+        self.speed = speed
+        self.baseUrl = CONFIG["url"]
+        self.events = recorder.read_recording(os.path.join(directory, recorder.EVENTS_FILE))
+        self.games = {}
+        for path in glob.glob(os.path.join(directory, recorder.game_file("*"))):
+            game_id = os.path.basename(path)[len("game-"):-len(".ndjson")]
+            self.games[game_id] = recorder.read_recording(path)
+        first_lines = [lines[0][0] for lines in [self.events] + list(self.games.values()) if lines]
+        self.recorded_start = min(first_lines) if first_lines else 0
+        self.start = time.time()
+        self.events_done = threading.Event()
+        self.event_stream_opened = False
+
+        self.lock = threading.Lock()
+        self.last_line = {}
+        self.latencies = []
+        self.moves = 0
+        self.chat_lines = 0
+
+    def due(self, timestamp):
+        return self.start + (timestamp - self.recorded_start) / self.speed
+
+    def line_received(self, game_id):
+        with self.lock:
+            self.last_line[game_id] = time.time()
+
+    def get_event_stream(self):
+        if self.event_stream_opened:
+            # the recording is over, reconnects get an empty stream.
+            return ReplayResponse(self, [])
+        self.event_stream_opened = True
+        return ReplayResponse(self, self.events)
+
+    def get_game_stream(self, game_id):
+        if game_id not in self.games:
+            # like a missing game on Lichess, a 404 response that the caller has to check.
+            response = ReplayResponse(self, [], game_id)
+            response.status_code = 404
+            return response
+        return ReplayResponse(self, self.games[game_id], game_id)
+
+    def get_ongoing_games(self):
+        return []
+
+    def make_move(self, game_id, move, offering_draw=False):
+        with self.lock:
+            self.moves += 1
+            if game_id in self.last_line:
+                self.latencies.append(time.time() - self.last_line[game_id])
+
+    def chat(self, game_id, room, text):
+        with self.lock:
+            self.chat_lines += 1
+
+    def accept_challenge(self, challenge_id):
+        pass
+
+    def decline_challenge(self, challenge_id):
+        pass
+
+    def abort(self, game_id):
+        pass
+
+    def resign(self, game_id):
+        pass
+
+
+class ThreadPool:
+    """Runs every game on a thread of this process, in place of the worker pool."""
+
+    @staticmethod
+    def apply_async(func, args):
+        threading.Thread(target=func, args=args, daemon=True).start()
+
+
+def replay(directory, config, speed=1, think=0):
+    bot = importlib.import_module("lichess-bot")
+    with open(os.path.join(directory, recorder.PROFILE_FILE)) as profile_file:
+        profile = json.load(profile_file)
+
+    li = ReplayLichess(directory, speed)
+    account = Account(li, profile, lambda board, *args: StubEngine(board, think), config)
+    control_queue = queue.Queue()
+    account.challenge_queue = []
+    admission = AdmissionWorkers(control_queue)
+    pool = ThreadPool()
+
+    start_cpu = time.process_time()
+    threading.Thread(target=bot.watch_control_stream, args=[control_queue, li, account.username],
+                     daemon=True).start()
+    while not (li.events_done.is_set() and control_queue.empty() and account.busy_processes == 0):
+        try:
+            event = control_queue.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if event["type"] == "reconnected":
+            continue  # only the end of the recording
+        bot.handle_event(event, account, [account], pool, control_queue, admission)
+    admission.close()
+
+    latencies = sorted(li.latencies)
+    games = account.games_finished
+    return {
+        "games": games,
+        "moves": li.moves,
+        "chat lines": li.chat_lines,
+        "p50 move ms": round(1000 * latencies[len(latencies) // 2], 2) if latencies else None,
+        "p99 move ms": round(1000 * latencies[int(len(latencies) * 0.99)], 2) if latencies else None,
+        "rss growth per game KB": round(account.rss_growth / games / 1024) if games else None,
+        "cpu s": round(time.process_time() - start_cpu, 2),
+        "wall s": round(time.time() - li.start, 2),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Replay recorded Lichess streams with a stub engine')
+    parser.add_argument('recordings', help='Directory recorded with record_streams.')
+    parser.add_argument('--speed', type=float, default=1, help='Replay this many times faster than recorded.')
+    parser.add_argument('--think', type=float, default=0, help='Milliseconds the stub engine thinks per move.')
+    parser.add_argument('--config', help='Configuration to replay with (the engine section is ignored).')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)-15s: %(message)s")
+    REPLAY_CONFIG = dict(CONFIG)
+    if args.config:
+        with open(args.config) as config_file:
+            REPLAY_CONFIG.update(yaml.load(config_file, Loader=yaml.FullLoader))
+    print(replay(args.recordings, REPLAY_CONFIG, args.speed, args.think / 1000))
@@ -0,0 +1,81 @@
+"""
+Snapshots of the games in progress, so a restarted bot can resume them right away.
+
+A snapshot is written after every move the bot makes: a board checkpoint (the FEN the engine searched and the number of
+moves played before it), the engine state (past scores, score history, pondering) and the abort timer. When the game
+is resumed, the board is rebuilt from the checkpoint plus the few moves played since, and the engine is started while
+the game stream connects.
+"""
+
+import json
+import logging
+import os
+
+import chess
+from chess.variant import find_variant
+
+logger = logging.getLogger(__name__)
+
+
+def snapshot_path(directory, game_id):
+    return os.path.join(directory, "{}.json".format(game_id))
+
+
+def save(directory, game_id, snapshot):
+    os.makedirs(directory, exist_ok=True)
+    path = snapshot_path(directory, game_id)
+    # written to a temporary file first, so a crash while writing never leaves a broken snapshot.
+    with open(path + ".tmp", "w") as snapshot_file:
+        json.dump(snapshot, snapshot_file)
+    os.replace(path + ".tmp", path)
+
+
+def load(directory, game_id):
+    try:
+        with open(snapshot_path(directory, game_id)) as snapshot_file:
+            return json.load(snapshot_file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as exception:
+        logger.warning("Ignoring the snapshot of {}: {}".format(game_id, exception))
+        return None
+
+
+def remove(directory, game_id):
+    try:
+        os.remove(snapshot_path(directory, game_id))
+    except FileNotFoundError:
+        pass
+
+
+def checkpoint(game, board, ply, engine):
+    """The snapshot of `game` with `board`, the position after `ply` moves."""
+    moves = game.state["moves"].split()
+    return {
+        "fen": board.fen(),
+        "variant": type(board).uci_variant,
+        "chess960": board.chess960,
+        "ply": ply,
+        "last_move": moves[ply - 1] if ply else None,
+        "speed": game.speed,
+        "variant_key": game.variant_key,
+        "rating": game.opponent.rating,
+        "abort_at": game.abort_at,
+        "engine": engine.get_state(),
+    }
+
+
+def snapshot_board(snapshot):
+    """The checkpoint board, without a move stack."""
+    return find_variant(snapshot["variant"])(snapshot["fen"], chess960=snapshot["chess960"])
+
+
+def restore_board(snapshot, moves):
+    """The checkpoint board with the moves played since pushed, or None if the snapshot doesn't fit `moves`."""
+    ply = snapshot["ply"]
+    if ply > len(moves) or (ply and moves[ply - 1] != snapshot["last_move"]):
+        return None
+    board = snapshot_board(snapshot)
+    for move in moves[ply:]:
+        board.push(chess.Move.from_uci(move))
+    return board
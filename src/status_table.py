@@ -0,0 +1,134 @@
+"""
+A live status table of the running games, shared through a memory-mapped file (`status_table` in config.yml).
+
+`start()` creates the table with a fixed-size record per game slot and hands a slot to every game it starts. The
+worker playing the game rewrites its record after each of its moves, without locks or messages to other processes:
+a sequence number is made odd while the record is written and even again after it, and readers retry a record they
+caught halfway. `lichess-bot.py top` reads the file directly, so watching the games costs the bot nothing.
+
+usage: python lichess-bot.py top [--config config.yml] [--interval 1] [--once]
+"""
+
+import mmap
+import os
+import struct
+import time
+
+MAGIC = b"LBST"
+HEADER = struct.Struct("<4sI")
+SEQUENCE = struct.Struct("<I")
+# pid, game id, speed, our clock and the opponent's (ms), plies, score (cp), depth, nps, pondering, latency (s),
+# updated (unix time). a pid of 0 is a free slot.
+FIELDS = struct.Struct("<i12s14siiHihQ?fd")
+RECORD_SIZE = 80
+NO_SCORE = -(1 << 31)
+READ_ATTEMPTS = 10
+
+tables = {}
+
+
+def open_table(path):
+    """The table at `path`, mapped once per process."""
+    if path not in tables:
+        tables[path] = StatusTable(path)
+    return tables[path]
+
+
+class StatusTable:
+    def __init__(self, path, slots=None, writable=True):
+        """Maps the table at `path`, or creates it with room for `slots` games."""
+        if slots is not None:
+            with open(path, "wb") as table_file:
+                table_file.write(HEADER.pack(MAGIC, slots) + bytes(slots * RECORD_SIZE))
+        with open(path, "r+b" if writable else "rb") as table_file:
+            self.buffer = mmap.mmap(table_file.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        magic, self.slots = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC:
+            raise ValueError("{} is not a status table".format(path))
+        # only used by the owner of the table.
+        self.games = [None] * self.slots
+
+    def claim(self, game_id):
+        """A free slot for the game, or None if every slot is taken."""
+        if game_id in self.games:
+            return self.games.index(game_id)
+        if None not in self.games:
+            return None
+        slot = self.games.index(None)
+        self.games[slot] = game_id
+        return slot
+
+    def release(self, game_id):
+        if game_id in self.games:
+            slot = self.games.index(game_id)
+            self.games[slot] = None
+            self._write(slot, bytes(FIELDS.size))
+
+    def write(self, slot, game_id, speed, my_clock, opponent_clock, plies, score=None, depth=None, nps=None,
+              pondering=False, latency=0):
+        self._write(slot, FIELDS.pack(os.getpid(), game_id.encode()[:12], speed.encode()[:14], int(my_clock),
+                                      int(opponent_clock), min(plies, 0xFFFF),
+                                      NO_SCORE if score is None else max(NO_SCORE + 1, min(score, (1 << 31) - 1)),
+                                      depth or 0, int(nps or 0), pondering, latency, time.time()))
+
+    def _write(self, slot, fields):
+        offset = HEADER.size + slot * RECORD_SIZE
+        sequence = SEQUENCE.unpack_from(self.buffer, offset)[0]
+        SEQUENCE.pack_into(self.buffer, offset, (sequence + 1) & 0xFFFFFFFF)
+        self.buffer[offset + SEQUENCE.size:offset + SEQUENCE.size + FIELDS.size] = fields
+        SEQUENCE.pack_into(self.buffer, offset, (sequence + 2) & 0xFFFFFFFF)
+
+    def read(self):
+        """The records of the games in progress, as dicts."""
+        records = []
+        for slot in range(self.slots):
+            offset = HEADER.size + slot * RECORD_SIZE
+            for _ in range(READ_ATTEMPTS):
+                before = SEQUENCE.unpack_from(self.buffer, offset)[0]
+                fields = FIELDS.unpack_from(self.buffer, offset + SEQUENCE.size)
+                if before % 2 == 0 and SEQUENCE.unpack_from(self.buffer, offset)[0] == before:
+                    break
+            else:
+                continue  # being rewritten too often to read, it's shown on the next refresh
+            pid, game_id, speed, my_clock, opponent_clock, plies, score, depth, nps, pondering, latency, updated = \
+                fields
+            if pid == 0:
+                continue
+            records.append({"slot": slot, "pid": pid, "game_id": game_id.rstrip(b"\0").decode(),
+                            "speed": speed.rstrip(b"\0").decode(), "my_clock": my_clock,
+                            "opponent_clock": opponent_clock, "plies": plies,
+                            "score": None if score == NO_SCORE else score, "depth": depth, "nps": nps,
+                            "pondering": pondering, "latency": latency, "updated": updated})
+        return records
+
+
+def format_clock(milliseconds):
+    seconds = max(0, milliseconds) // 1000
+    return "{}:{:02d}".format(seconds // 60, seconds % 60)
+
+
+def format_table(records, now):
+    """The records as text, the slowest last move first."""
+    lines = ["{:<12} {:<12} {:>7} {:>7} {:>5} {:>7} {:>5} {:>8} {:>6} {:>8} {:>6}".format(
+        "GAME", "SPEED", "CLOCK", "OPP", "PLY", "EVAL", "DEPTH", "KNPS", "PONDER", "LATENCY", "AGE")]
+    for record in sorted(records, key=lambda r: -r["latency"]):
+        lines.append("{:<12} {:<12} {:>7} {:>7} {:>5} {:>7} {:>5} {:>8} {:>6} {:>7.2f}s {:>5.0f}s".format(
+            record["game_id"], record["speed"], format_clock(record["my_clock"]),
+            format_clock(record["opponent_clock"]), record["plies"],
+            "-" if record["score"] is None else "{:+.2f}".format(record["score"] / 100), record["depth"] or "-",
+            record["nps"] // 1000 or "-", "yes" if record["pondering"] else "no", record["latency"],
+            now - record["updated"]))
+    if not records:
+        lines.append("No games in progress.")
+    return "\n".join(lines)
+
+
+def top(path, interval=1, once=False):
+    table = StatusTable(path, writable=False)
+    while True:
+        text = format_table(table.read(), time.time())
+        if once:
+            print(text)
+            return
+        print("\033[H\033[J" + text, flush=True)
+        time.sleep(interval)
@@ -0,0 +1,170 @@
+"""
+Offline tuning of the draw offer and resignation conditions.
+
+The bot appends the score history of every finished game to the file set in `engine.score_history`. This module
+replays those histories and sweeps the `offer_draw` and `resignation` settings with NumPy, picking for every speed the
+settings that maximise our score per engine-second without giving away more than `--max-score-loss` of expected score.
+The output can be pasted into config.yml; every value is a dict per speed, just like `Hash`. Draws are only offered
+where `draw_allowed` lets the bot offer them; histories recorded before the halfmove clock was saved don't limit it.
+
+usage: python -m src.tuning score_history.jsonl
+"""
+
+import argparse
+import json
+
+import numpy as np
+import yaml
+
+from src.engine_wrapper import draw_allowed
+
+RESIGN_THRESHOLDS = np.arange(200, 2001, 50)
+DRAW_THRESHOLDS = np.arange(0, 101, 5)
+SUSTAIN_TURNS = range(1, 11)
+MINIMUM_TURNS = (0, 20, 30, 40, 60)
+
+
+def load_histories(path):
+    """Groups the recorded games by speed."""
+    histories = {}
+    with open(path) as history_file:
+        for line in history_file:
+            if line.strip():
+                record = json.loads(line)
+                histories.setdefault(record["speed"], []).append(record)
+    return histories
+
+
+def to_arrays(records):
+    """Pads the per-move histories of the games into (games, moves) arrays. Missing scores are NaN."""
+    length = max(len(record["moves"]) for record in records)
+    shape = (len(records), length)
+    arrays = {
+        "fullmove": np.zeros(shape, dtype=np.int32),
+        "score": np.full(shape, np.nan),
+        "seconds": np.zeros(shape),
+        "endgame": np.zeros(shape, dtype=bool),
+        "halfmove": np.full(shape, np.iinfo(np.int32).max, dtype=np.int32),
+        "valid": np.zeros(shape, dtype=bool),
+        "result": np.array([record["result"] for record in records], dtype=float),
+    }
+    for row, record in enumerate(records):
+        moves = record["moves"]
+        arrays["fullmove"][row, :len(moves)] = [move[0] for move in moves]
+        arrays["score"][row, :len(moves)] = [np.nan if move[1] is None else move[1] for move in moves]
+        arrays["seconds"][row, :len(moves)] = [move[2] for move in moves]
+        arrays["endgame"][row, :len(moves)] = [move[3] for move in moves]
+        if moves and len(moves[0]) > 4:
+            arrays["halfmove"][row, :len(moves)] = [move[4] for move in moves]
+        arrays["valid"][row, :len(moves)] = True
+    arrays["elapsed"] = np.cumsum(arrays["seconds"], axis=1)
+    return arrays
+
+
+def rolling_max(values, window):
+    """The maximum of the last `window` values at every move, or +inf if there are fewer than `window` values."""
+    result = values.copy()
+    for shift in range(1, window):
+        shifted = np.full_like(values, np.inf)
+        shifted[:, shift:] = values[:, :-shift]
+        result = np.maximum(result, shifted)
+    return result
+
+
+def outcomes(arrays, triggered, triggered_result, acceptance=1.0):
+    """Expected score and engine seconds per game when the game ends at the first triggered move.
+
+    `triggered` has the shape (settings, games, moves); the returned arrays have the shape (settings, games)."""
+    fired = triggered.any(axis=2)
+    first = triggered.argmax(axis=2)
+    games = np.arange(triggered.shape[1])
+    total = arrays["elapsed"][:, -1]
+    result = np.where(fired, acceptance * triggered_result + (1 - acceptance) * arrays["result"], arrays["result"])
+    seconds = np.where(fired, acceptance * arrays["elapsed"][games, first] + (1 - acceptance) * total, total)
+    return result, seconds
+
+
+def best_setting(settings, results, seconds, baseline, max_score_loss):
+    """Index of the setting with the best score per engine-second among those which keep the expected score."""
+    expected = results.mean(axis=1)
+    efficiency = results.sum(axis=1) / np.maximum(seconds.sum(axis=1), 1e-9)
+    efficiency[expected < baseline - max_score_loss] = -np.inf
+    best = int(np.argmax(efficiency))
+    return settings[best], float(expected[best]), float(efficiency[best])
+
+
+def tune_resignation(arrays, max_score_loss):
+    scores = np.where(arrays["valid"] & ~np.isnan(arrays["score"]), arrays["score"], np.inf)
+    baseline = arrays["result"].mean()
+    settings, results, seconds = [], [], []
+    for endgame_only in (True, False):
+        gate = arrays["valid"] & (arrays["endgame"] if endgame_only else True)
+        for sustain_turns in SUSTAIN_TURNS:
+            losing = rolling_max(scores, sustain_turns)
+            triggered = (losing[None] <= -RESIGN_THRESHOLDS[:, None, None]) & gate[None]
+            result, elapsed = outcomes(arrays, triggered, 0)
+            settings.extend({"threshold": int(threshold), "sustain_turns": sustain_turns,
+                             "endgame_only": endgame_only} for threshold in RESIGN_THRESHOLDS)
+            results.append(result)
+            seconds.append(elapsed)
+    return best_setting(settings, np.concatenate(results), np.concatenate(seconds), baseline, max_score_loss)
+
+
+def tune_draw(arrays, max_score_loss, acceptance):
+    scores = np.where(arrays["valid"] & ~np.isnan(arrays["score"]), np.abs(arrays["score"]), np.inf)
+    baseline = arrays["result"].mean()
+    settings, results, seconds = [], [], []
+    for endgame_only in (True, False):
+        for sustain_turns in SUSTAIN_TURNS:
+            balanced = rolling_max(scores, sustain_turns)
+            for minimum_turns in MINIMUM_TURNS:
+                conditions = {"minimum_turns": minimum_turns, "sustain_turns": sustain_turns,
+                              "endgame_only": endgame_only}
+                allowed = arrays["valid"] & draw_allowed(conditions, arrays["fullmove"], arrays["halfmove"],
+                                                         arrays["endgame"])
+                triggered = (balanced[None] <= DRAW_THRESHOLDS[:, None, None]) & allowed[None]
+                result, elapsed = outcomes(arrays, triggered, 0.5, acceptance)
+                settings.extend({"threshold": int(threshold), "sustain_turns": sustain_turns,
+                                 "minimum_turns": minimum_turns, "endgame_only": endgame_only}
+                                for threshold in DRAW_THRESHOLDS)
+                results.append(result)
+                seconds.append(elapsed)
+    return best_setting(settings, np.concatenate(results), np.concatenate(seconds), baseline, max_score_loss)
+
+
+def tune(histories, max_score_loss=0.01, draw_acceptance=0.5, minimum_games=20):
+    """Returns the `offer_draw` and `resignation` config sections with one value per speed for every setting."""
+    config = {"offer_draw": {}, "resignation": {}}
+    for speed, records in sorted(histories.items()):
+        if len(records) < minimum_games:
+            print("Skipping {}: only {} games recorded.".format(speed, len(records)))
+            continue
+        arrays = to_arrays(records)
+        baseline = arrays["result"].mean()
+        baseline_efficiency = arrays["result"].sum() / max(arrays["elapsed"][:, -1].sum(), 1e-9)
+        print("{}: {} games, expected score {:.3f}, {:.4f} points per engine-second".format(
+            speed, len(records), baseline, baseline_efficiency))
+
+        for section, (setting, expected, efficiency) in (
+                ("resignation", tune_resignation(arrays, max_score_loss)),
+                ("offer_draw", tune_draw(arrays, max_score_loss, draw_acceptance))):
+            print("    {}: {} -> expected score {:.3f}, {:.4f} points per engine-second".format(
+                section, setting, expected, efficiency))
+            for name, value in setting.items():
+                config[section].setdefault(name, {})[speed] = value
+    return config
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Tune the draw offer and resignation settings from recorded games')
+    parser.add_argument('history', help='Score history file written by the bot (`engine.score_history`).')
+    parser.add_argument('--max-score-loss', type=float, default=0.01,
+                        help='Largest drop in expected score per game accepted to save engine time.')
+    parser.add_argument('--draw-acceptance', type=float, default=0.5,
+                        help='Assumed probability that the opponent accepts a draw offer.')
+    parser.add_argument('--minimum-games', type=int, default=20, help='Games needed to tune a speed.')
+    args = parser.parse_args()
+
+    TUNED = tune(load_histories(args.history), args.max_score_loss, args.draw_acceptance, args.minimum_games)
+    print()
+    print(yaml.dump({"engine": TUNED}, default_flow_style=False))
@@ -0,0 +1,52 @@
+from src.admission_policy import AdmissionPolicy
+from src.model import Challenge
+
+
+def challenge(challenge_id, rating, rated=True, limit=180):
+    return Challenge({
+        "id": challenge_id, "rated": rated, "variant": {"key": "standard"}, "perf": {"name": "Blitz"},
+        "speed": "blitz", "timeControl": {"limit": limit, "increment": 0},
+        "challenger": {"name": challenge_id, "rating": rating, "title": None},
+    })
+
+
+def policy(score):
+    """A rating policy rated 2000 in blitz whose recorded games against 2000 players scored `score`."""
+    rating_policy = AdmissionPolicy({"sort_by": "rating"}, {"blitz": {"rating": 2000}})
+    for _ in range(5):
+        rating_policy.record_game("blitz", "standard", 360, 300, 100, score, 2000)
+    return rating_policy
+
+
+def test_positive_gain_prefers_shorter_games():
+    rating_policy = policy(1)
+    long_game, short_game = challenge("long", 2000, limit=900), challenge("short", 2000, limit=60)
+    assert rating_policy.expected_rating_gain(short_game) > 0
+    assert rating_policy.rank([long_game, short_game]) == [short_game, long_game]
+
+
+def test_negative_gain_does_not_prefer_longer_games():
+    rating_policy = policy(0)
+    short_game, long_game = challenge("short", 2000, limit=60), challenge("long", 2000, limit=900)
+    assert rating_policy.expected_rating_gain(short_game) < 0
+    assert rating_policy.priority(short_game) == rating_policy.priority(long_game) == 0
+    assert rating_policy.rank([short_game, long_game]) == [short_game, long_game]
+
+
+def test_unrated_ranks_with_negative_gain_in_arrival_order():
+    rating_policy = policy(0)
+    losing, unrated = challenge("losing", 2400), challenge("unrated", 2400, rated=False)
+    assert rating_policy.priority(losing) == rating_policy.priority(unrated) == 0
+    assert rating_policy.rank([losing, unrated]) == [losing, unrated]
+    assert rating_policy.rank([unrated, losing]) == [unrated, losing]
+
+
+def test_positive_gain_ranks_above_unrated():
+    rating_policy = policy(1)
+    unrated, winning = challenge("unrated", 2000, rated=False), challenge("winning", 2000)
+    assert rating_policy.rank([unrated, winning]) == [winning, unrated]
+
+
+def test_no_history_values_rated_and_unrated_games_alike():
+    rating_policy = AdmissionPolicy({"sort_by": "rating"}, {"blitz": {"rating": 2000}})
+    assert rating_policy.priority(challenge("rated", 1500)) == rating_policy.priority(challenge("unrated", 1500, False))